@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script keeps a persisted record of the last successful FSVR self-alignment (`*CAL?`),
+so that a restart of the DAQ can skip the lengthy calibration while the record is still valid.
+The record is considered valid when it belongs to the same instrument (`*IDN?`),
+is not older than `maxAge`, and the frontend temperature has not drifted by more than `maxDrift`.
+'''
+
+import os, time, json, logging
+
+
+class CalibrationCache():
+    '''
+    a json file holding the timestamp, the instrument ID and the frontend temperature of the last calibration
+    '''
+
+    def __init__(self, fileName, maxAge=12*3600, maxDrift=5):
+        '''
+        fileName:   path of the json file to keep the calibration record
+        maxAge:     maximum age of a reusable calibration [s]
+        maxDrift:   maximum frontend temperature drift of a reusable calibration [K]
+        '''
+        self.fileName = fileName
+        self.maxAge = maxAge
+        self.maxDrift = maxDrift
+        self.logger = logging.getLogger("CAL")
+
+    def load(self):
+        '''
+        return the stored record, or None if there is no readable one
+        '''
+        try:
+            with open(self.fileName, 'r') as record:
+                return json.load(record)
+        except (OSError, ValueError):
+            return None
+
+    def valid(self, ident, temperature):
+        '''
+        check if the stored record can be reused for the instrument `ident` at `temperature` [°C]
+        '''
+        record = self.load()
+        if record is None:
+            return False
+        if record.get("instrument") != ident:
+            self.logger.info("calibration record belongs to another instrument")
+            return False
+        age = time.time() - record.get("epoch", 0)
+        if not 0 <= age <= self.maxAge:
+            self.logger.info("calibration record is expired ({:.0f} s old)".format(age))
+            return False
+        if temperature is None or record.get("temperature") is None or abs(temperature - record["temperature"]) > self.maxDrift:
+            self.logger.info("frontend temperature drifted since the last calibration")
+            return False
+        return True
+
+    def store(self, ident, temperature):
+        '''
+        persist a new record after a passed calibration, atomically replacing the old one
+        '''
+        timestamp = time.localtime()
+        record = {
+                "instrument": ident,
+                "temperature": temperature, # °C
+                "epoch": time.time(), # s
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z", timestamp),
+                }
+        with open(self.fileName + ".tmp", 'w') as tmp:
+            json.dump(record, tmp, indent=4, sort_keys=True)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(self.fileName + ".tmp", self.fileName)
+
+    def clear(self):
+        '''
+        drop the stored record, e.g. after a failed calibration
+        '''
+        try:
+            os.remove(self.fileName)
+        except FileNotFoundError:
+            pass
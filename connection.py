@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a resilient TCP connection to the SCPI instruments, so that a network glitch
+makes the current command fail within a timeout instead of leaving the DAQ waiting forever.
+    timeouts:   the connecting and every single send/receive are bounded
+    keepalive:  the TCP keepalive probes detect a dead peer even when nothing is being sent
+    reconnect:  the connection is re-opened with an exponential backoff, with jitter, until it succeeds
+The instrument above it is in charge of the health check and of restoring its configuration after a reconnect.
+'''
+
+import socket, time, random, logging, threading
+
+
+class ConnectionLost(IOError):
+    '''
+    the connection is broken or timed out, and has been closed
+    '''
+    pass
+
+
+class Connection():
+    '''
+    a TCP connection with timeouts, keepalive and reconnect with backoff
+    '''
+
+    def __init__(self, host, port, timeout=10, connectTimeout=5, keepalive=(10, 5, 3), backoff=(1, 60), logger=None):
+        '''
+        host:           address of the instrument
+        port:           port of the instrument
+        timeout:        default timeout of a send or a receive [s]
+        connectTimeout: timeout of opening the connection [s]
+        keepalive:      idle time before the first probe [s], interval between the probes [s], number of probes
+        backoff:        first and maximum delay between two reconnect attempts [s]
+        logger:         logger of the instrument
+        '''
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.keepalive = keepalive
+        self.backoff = backoff
+        self.logger = logger or logging.getLogger("CONN")
+        self.sock = None
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def open(self):
+        sock = socket.create_connection((self.host, self.port), self.connectTimeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # the fine tuning of the probes is not available on every platform
+        idle, interval, count = self.keepalive
+        for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        with self.lock:
+            self.sock = sock
+
+    def close(self):
+        with self.lock:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def fail(self, error, action):
+        # a half-done exchange leaves the stream out of step, hence the connection is dropped
+        self.close()
+        self.logger.warning("connection to {:s}:{:d} is lost on {:s}: {}".format(self.host, self.port, action, error))
+        raise ConnectionLost("{:s} on {:s}:{:d} fails: {}".format(action, self.host, self.port, error)) from error
+
+    def send(self, data):
+        if self.sock is None:
+            raise ConnectionLost("{:s}:{:d} is not connected".format(self.host, self.port))
+        try:
+            self.sock.sendall(data)
+        except OSError as error:
+            self.fail(error, "send")
+
+    def recv(self, size=4096, timeout=None):
+        '''
+        timeout: timeout of this receive [s], e.g. for a long operation, the default one if None
+        '''
+        if self.sock is None:
+            raise ConnectionLost("{:s}:{:d} is not connected".format(self.host, self.port))
+        try:
+            if timeout is not None:
+                self.sock.settimeout(timeout)
+            data = self.sock.recv(size)
+            if timeout is not None:
+                self.sock.settimeout(self.timeout)
+        except OSError as error:
+            self.fail(error, "receive")
+        if not data:
+            self.fail(ConnectionResetError("closed by the peer"), "receive")
+        return data
+
+    def reconnect(self, stopped=None):
+        '''
+        re-open the connection, retrying with an exponential backoff until it succeeds
+        stopped:    threading.Event to give up waiting
+        return the number of attempts
+        '''
+        self.close()
+        delay, maxDelay = self.backoff
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.open()
+                self.logger.info("connection to {:s}:{:d} is restored after {:d} attempt(s)".format(self.host, self.port, attempt))
+                return attempt
+            except OSError as error:
+                self.logger.debug("reconnect attempt {:d} fails: {}".format(attempt, error))
+            # the jitter keeps the instruments from reconnecting in lockstep
+            wait = delay * random.uniform(.8, 1.2)
+            if stopped is not None:
+                if stopped.wait(wait):
+                    raise ConnectionLost("reconnect to {:s}:{:d} is cancelled".format(self.host, self.port))
+            else:
+                time.sleep(wait)
+            delay = min(delay * 2, maxDelay)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a local network API to monitor and control the acquisition without the Qt GUI.
+It is a plain HTTP server run in its own threads:
+    GET  /status    the latest state of the acquisition, in json
+    GET  /events    a push stream of the events (phase transitions, progress, timings, triggers, alarms),
+                    in the server-sent events format, e.g. `curl -N http://<host>:<port>/events`
+    POST /command   a command in json, e.g. {"command": "start"}, forwarded to the acquisition
+Each subscriber gets a bounded queue of its own, so a slow client loses its oldest events
+instead of loading the acquisition. The commands are only validated here and passed to a handler,
+whose results come back through the event stream.
+To try it against a stand-in of the acquisition (`StandIn`), run `python3 control.py`.
+'''
+
+import json, time, queue, logging, threading, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+COMMANDS = ("set", "start", "stop", "scan")
+
+
+class EventBus():
+    '''
+    fan out the events to the subscribers, and keep the latest state of the acquisition
+    '''
+
+    def __init__(self, backlog=1000):
+        '''
+        backlog: maximum number of events queued for one subscriber
+        '''
+        self.backlog = backlog
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.state = {}
+
+    def publish(self, kind, **fields):
+        '''
+        kind:   type of the event, e.g. 'phase', 'progress', 'timings', 'trigger', 'alarm', 'run'
+        fields: content of the event, merged into the state under `kind`
+        '''
+        event = dict(fields, kind=kind, time=time.time())
+        # under the lock, so that no other publisher fills the queue between dropping and putting,
+        # a publisher must never fail, as it may be in the middle of a recording
+        with self.lock:
+            self.state[kind] = event
+            for subscriber in self.subscribers:
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    # drop the oldest event of a slow subscriber
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+                    subscriber.put_nowait(event)
+
+    def subscribe(self):
+        subscriber = queue.Queue(self.backlog)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.state))
+
+
+class ControlServer():
+    '''
+    the HTTP server of the API
+    '''
+
+    def __init__(self, bus, handler, host="127.0.0.1", port=8025, token=None):
+        '''
+        bus:        EventBus of the acquisition
+        handler:    callback function `handler(command)` with the command dict, to be thread-safe
+        host:       address to listen on, '0.0.0.0' to open to the network
+        port:       port to listen on
+        token:      if set, the commands need it in the header 'X-DAQ-Token'
+        '''
+        self.bus = bus
+        self.handler = handler
+        self.token = token
+        self.logger = logging.getLogger("CTRL")
+        self.stopped = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), self.requestHandler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def requestHandler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                server.logger.debug(format % args)
+
+            def reply(self, code, content):
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self.reply(200, server.bus.snapshot())
+                elif self.path == "/events":
+                    self.stream()
+                else:
+                    self.reply(404, {"error": "unknown path"})
+
+            def stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                subscriber = server.bus.subscribe()
+                try:
+                    while not server.stopped.is_set():
+                        try:
+                            event = subscriber.get(timeout=15)
+                            self.wfile.write("event: {:s}\ndata: {:s}\n\n".format(event["kind"], json.dumps(event)).encode("utf-8"))
+                        except queue.Empty:
+                            self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    server.bus.unsubscribe(subscriber)
+
+            def do_POST(self):
+                if self.path != "/command":
+                    self.reply(404, {"error": "unknown path"})
+                    return
+                if server.token is not None and self.headers.get("X-DAQ-Token") != server.token:
+                    self.reply(403, {"error": "invalid token"})
+                    return
+                try:
+                    command = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                except ValueError:
+                    self.reply(400, {"error": "invalid json"})
+                    return
+                error = server.validate(command)
+                if error is not None:
+                    self.reply(400, {"error": error})
+                    return
+                server.logger.info("command '{:s}' from {:s}".format(command["command"], self.client_address[0]))
+                server.handler(command)
+                self.reply(202, {"accepted": command["command"]})
+
+        return RequestHandler
+
+    def validate(self, command):
+        '''
+        return the error of a malformed command, or None
+        '''
+        if not isinstance(command, dict) or command.get("command") not in COMMANDS:
+            return "command must be one of {}".format(", ".join(COMMANDS))
+        if command["command"] == "set" and not isinstance(command.get("parameters"), dict):
+            return "'set' needs a dict of 'parameters'"
+        if command["command"] == "scan":
+            plan = command.get("plan")
+            if not isinstance(plan, list) or not plan or not all(isinstance(step, dict) and isinstance(step.get("files"), int) and step["files"] > 0 for step in plan):
+                return "'scan' needs a 'plan' of parameter dicts, each with a positive number of 'files'"
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="control", daemon=True)
+        self.thread.start()
+        self.logger.info("API is listening on {:s}:{:d}".format(*self.httpd.server_address[:2]))
+
+    def stop(self):
+        self.stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StandIn():
+    '''
+    a stand-in of the acquisition, which simulates the phases of the files after a 'start'
+    '''
+
+    def __init__(self, bus, step=.2):
+        '''
+        bus:    EventBus the events are published to
+        step:   time between two progress events [s]
+        '''
+        self.bus = bus
+        self.step = step
+        self.running = threading.Event()
+        self.thread = None
+
+    def acquire(self):
+        number = 1
+        while self.running.is_set():
+            name = time.strftime("%Y%m%d_%H%M%S")
+            self.bus.publish("trigger")
+            for phase in ("prepared", "recorded", "exporting", "exported", "header"):
+                if phase in ("recorded", "exported"):
+                    for percentVal in range(0, 101, 20):
+                        self.bus.publish("progress", stage="record" if phase == "recorded" else "export", value=percentVal)
+                        time.sleep(self.step)
+                self.bus.publish("phase", phase=phase, name=name, number=number)
+            self.bus.publish("timings", name=name, number=number, dt1=.5, dt2=1., dt3=1.)
+            number += 1
+        self.bus.publish("run", state="stopped")
+
+    def handler(self, command):
+        '''
+        the handler of the commands, as passed to the ControlServer
+        '''
+        if command["command"] == "start" and not self.running.is_set():
+            self.running.set()
+            self.bus.publish("run", state="running")
+            self.thread = threading.Thread(target=self.acquire, daemon=True)
+            self.thread.start()
+        elif command["command"] == "stop":
+            self.running.clear()
+        else:
+            self.bus.publish("command", **command)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run the control API against a stand-in of the acquisition")
+    parser.add_argument("-p", "--port", type=int, default=8025, help="port to listen on")
+    args = parser.parse_args()
+    bus = EventBus()
+    server = ControlServer(bus, StandIn(bus).handler, port=args.port)
+    server.start()
+    print("stand-in is listening on port {:d}, press Ctrl+C to quit".format(args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
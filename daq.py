@@ -2,12 +2,23 @@
 # -*- coding:utf-8 -*-
 
 import sys, re, os
-import socket, time, logging, subprocess, json
+import time, logging, subprocess, json, threading
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 
-from multithread import Worker, WorkerSignals
+from multithread import Worker, WorkerSignals, IOThread
+from calibration import CalibrationCache
+from journal import Journal
+from transfer import ParallelPull
+from quality import QualityMonitor
+from reduction import DownConverter, process_pool
+from storage import StorageManager
+from control import EventBus, ControlServer
+from planner import number_of_samples
+from sizing import AdaptiveSizer
+from tracing import tracer
+from connection import Connection, ConnectionLost
 
 logging.basicConfig(
     level       = logging.INFO,
@@ -18,165 +29,311 @@ logging.basicConfig(
 
 
 class instrument():
-    def __init__(self, IP, port, logger):
+    def __init__(self, IP, port, logger, timeout=10, keepalive=(10, 5, 3), backoff=(1, 60), reset=True):
+        '''
+        reset:      reset the instrument once connected, not to interrupt a running operation if False
+        timeout:    timeout of a send or a receive [s]
+        keepalive:  TCP keepalive idle time [s], probe interval [s] and probe count
+        backoff:    first and maximum delay between two reconnect attempts [s]
+        '''
         self.IP = IP
         self.port = port
         self.logger = logger
+        self.conn = Connection(IP, port, timeout, keepalive=keepalive, backoff=backoff, logger=logger)
+        self.settings = [] # the configuration commands since the last reset, restored after a reconnect
         self.connect()
-        self.reset()
+        if reset:
+            self.reset()
 
     def connect(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect((self.IP, self.port))
+        self.conn.open()
+        self.ident = self.identify()
 
     def disconnect(self):
-        self.sock.close()
+        self.conn.close()
 
     def write(self, cmd):
-        cmd += '\n'
-        self.sock.send(cmd.encode("utf-8"))
+        with tracer.span("write", "scpi", device=self.logger.name, cmd=cmd):
+            cmd += '\n'
+            self.conn.send(cmd.encode("utf-8"))
 
-    def read(self):
-        data = self.sock.recv(4096)
+    def read(self, timeout=None):
+        '''
+        timeout: timeout of this reply [s], for the long operations, the default one if None
+        '''
+        with tracer.span("read", "scpi", device=self.logger.name) as span:
+            data = self.conn.recv(4096, timeout)
+            if tracer.enabled:
+                span.args["reply"] = data.decode("utf-8", "replace").strip()[:64]
         return data.decode("utf-8").strip()
 
+    def setup(self, cmd):
+        '''
+        write a configuration command, which is cached to be restored after a reconnect
+        '''
+        self.write(cmd)
+        self.settings.append(cmd)
+
     def reset(self):
         self.write("*RST; *WAI; *CLS")
+        self.settings = []
+
+    def identify(self):
+        self.write("*IDN?")
+        return self.read()
+
+    def healthy(self):
+        '''
+        check that the instrument answers its identity, any failure closes the connection
+        '''
+        if not self.conn.connected:
+            return False
+        try:
+            return self.identify() == self.ident
+        except ConnectionLost:
+            return False
+
+    def recover(self, stopped=None):
+        '''
+        reconnect with backoff, then restore the cached configuration
+        stopped:    threading.Event to give up reconnecting
+        '''
+        self.conn.reconnect(stopped)
+        ident = self.identify()
+        if ident != self.ident:
+            self.logger.warning("instrument is replaced, '{:s}' instead of '{:s}'".format(ident, self.ident))
+            self.ident = ident
+        # the instrument may have been power-cycled meanwhile, the configuration is written again from a clean state
+        settings = self.settings
+        self.reset()
+        for cmd in settings:
+            self.setup(cmd)
+        self.logger.info("{:d} setting(s) are restored".format(len(settings)))
+
+    def ensure(self, stopped=None):
+        '''
+        recover the connection if the health check fails, to be run on the I/O thread before a new task
+        return whether a recovery was needed
+        '''
+        if self.healthy():
+            return False
+        self.recover(stopped)
+        return True
+
+    def poll(self, cmd, done, interval=.1, timeout=None):
+        '''
+        query the instrument on a steady cadence until its reply is accepted, to be run on its I/O thread
+        cmd:        the query
+        done:       callback function `done(reply)`, true to stop polling
+        interval:   polling interval [s]
+        timeout:    maximum time to poll [s], None for no limit
+        return the last reply
+        '''
+        t0 = deadline = time.perf_counter()
+        while True:
+            self.write(cmd)
+            data = self.read()
+            if done(data):
+                return data
+            if timeout is not None and time.perf_counter() - t0 > timeout:
+                raise TimeoutError("'{:s}' is timed out with '{:s}'".format(cmd, data))
+            # the next query is scheduled from the previous one, not from the reply, to avoid drifting
+            deadline += interval
+            time.sleep(max(deadline - time.perf_counter(), 0))
 
 
 class FSVR(instrument):
-    def __init__(self, IP):
+    def __init__(self, IP, cache=None):
         super(FSVR, self).__init__(IP, 5025, logging.getLogger("FSVR"))
+        self.calibrationTimeout = 300 # s
+        self.calibrate(cache)
+
+    def temperature(self):
+        self.write("SOURce:TEMPerature:FRONtend?")
+        try:
+            return float(self.read())
+        except ValueError:
+            return None
+
+    def calibrate(self, cache=None):
+        '''
+        cache: CalibrationCache, skip the self-alignment if its record is still valid
+        '''
+        ident = self.ident
+        temp = self.temperature()
+        if cache is not None and cache.valid(ident, temp):
+            self.calibrated = True
+            self.logger.info("calibration of {:s} is reused".format(cache.load()["timestamp"]))
+            return
+        # the response of '*CAL?' only arrives once the self-alignment is completed, '0' for passed
         self.write("*CAL?")
-        # sleep 12 s for initial
-        
-    def acquire(self, CF, SRat, RLev, stdscr):
+        result = self.read(timeout=self.calibrationTimeout)
+        self.calibrated = result == '0'
+        if self.calibrated:
+            self.logger.info("calibration is passed")
+            if cache is not None:
+                cache.store(ident, temp)
+        else:
+            self.logger.warning("calibration is failed with '{:s}'".format(result))
+            if cache is not None:
+                cache.clear()
+
+    def acquire(self, CF, SRat, RLev, stopped, stdscr):
         '''
-        CF:   center frequency [Hz]
-        SRat: sampling rate [Hz]
-        RLev: reference level [dBm]
+        CF:         center frequency [Hz]
+        SRat:       sampling rate [Hz]
+        RLev:       reference level [dBm]
+        stopped:    threading.Event to give up reconnecting
         '''
+        self.ensure(stopped)
+        # the cached configuration is the one of this acquisition only
+        self.settings = []
         #print("FSVR: start acquire")
-        self.write("TRAC:IQ ON")
-        self.write("FREQuency:CENTer {:g}MHz".format(CF/1e6))
-        self.write("TRACe:IQ:SRATe {:g}MHz".format(SRat/1e6))
-        self.write("DISP:TRAC:Y:RLEV {:g}dBm".format(RLev))
-        self.write("INP:ATT:AUTO OFF")
-        self.write("INP:ATT 0dB")
-        self.write("OUTPut:DIQ ON")
-        self.write("OUTPut:UPOR:STAT ON")
+        self.setup("TRAC:IQ ON")
+        self.setup("FREQuency:CENTer {:g}MHz".format(CF/1e6))
+        self.setup("TRACe:IQ:SRATe {:g}MHz".format(SRat/1e6))
+        self.setup("DISP:TRAC:Y:RLEV {:g}dBm".format(RLev))
+        self.setup("INP:ATT:AUTO OFF")
+        self.setup("INP:ATT 0dB")
+        self.setup("OUTPut:DIQ ON")
+        self.setup("OUTPut:UPOR:STAT ON")
         self.logger.info("initialization is ready")
         
         # start data streaming
-        self.write("INITiate")
+        self.setup("INITiate")
         self.logger.info("data is streaming...")
         #print("FSVR: streaming")
 
 
 class IQR(instrument):
-    def __init__(self, IP, FileSize, SRat, fileName="data"):
-        super(IQR, self).__init__(IP, 5025, logging.getLogger("IQR"))
-        self.signals = WorkerSignals()
+    def __init__(self, IP, reset=True):
+        super(IQR, self).__init__(IP, 5025, logging.getLogger("IQR"), reset=reset)
+        self.armTimeout = 60 # s, to wait for the arming
+        self.recordMargin = 60 # s, to wait beyond the expected recording time
+        self.archiveTimeout = 30 # s, to wait for an export to start
+        self.exportRate = 10e6 # byte/s, the slowest throughput expected of an export
+        self.logger.info("connection is ready")
+
+    def exportTimeout(self, FileSize):
+        '''
+        return the maximum time of the export of a file of `FileSize` samples [s]
+        '''
+        return FileSize * 4 / self.exportRate + self.recordMargin
+
+    def archiveStarted(self, timeout):
+        '''
+        poll the IQR until an export is running, or already over for a short one
+        '''
+        try:
+            self.poll("SYSTem:ARCHive:RUNNing?", lambda data: data != '0', timeout=timeout)
+        except TimeoutError:
+            self.write("SYSTem:ARCHive:PROGress?")
+            if self.read() != '"100 %"':
+                raise
+
+    def configure(self, FileSize, SRat, fileName="data"):
         '''
         SRat: sampling rate [Hz]
         FileSize: number of samples to be recorded in one file
         '''
+        self.reset()
         self.duraTime = FileSize / SRat # s
+        self.fileSize = FileSize
         self.fileName = fileName # default, 'data'
-        self.write("INSTrument:SELect:MODE RECorder")
+        self.setup("INSTrument:SELect:MODE RECorder")
         # set the recodering data name 'data'
-        self.write("INPut:RECorder:WAVeform:SELect 'e:/" + self.fileName +"'")
-        self.write("INPut:RECorder:LIMits:CONDition FILesize")
-        self.write("INPut:RECorder:LIMits:FILesize {:d}".format(FileSize))
-        self.write("TRIGger:RECorder:SYNC SALone")
-        self.write("TRIGger:RECorder:SOURce MANual")
+        self.setup("INPut:RECorder:WAVeform:SELect 'e:/" + self.fileName +"'")
+        self.setup("INPut:RECorder:LIMits:CONDition FILesize")
+        self.setup("INPut:RECorder:LIMits:FILesize {:d}".format(FileSize))
+        self.setup("TRIGger:RECorder:SYNC SALone")
+        self.setup("TRIGger:RECorder:SOURce MANual")
         time.sleep(1.1)
 
         self.write("TRIGger:RECorder:ARM ONNO")
         self.time_IQR_ARMON = time.perf_counter()
         self.logger.info("initialization is ready")
 
-    def record(self, fileNumber):
-
-        def loop_arm(): # sponge time to wait for IQR arming
-            self.write("STATus:RECorder?")
-            data = self.read()
-            if data == '1':
-                self.signals.progress.emit(-1)
-                self.dt1 = time.time() - self.t0
-                self.logger.info("recording file {:d} '{:s}'".format(fileNumber, self.fileName))
-                self.logger.debug('estimated time of finish {:.2f} s'.format(self.duraTime))
-                self.t = 0
-                loop_record()
-                return
-            else:
-                QTimer.singleShot(100, loop_arm)
-
-        def loop_record(): # recording
-            self.write("STATus:RECorder?")
-            data = self.read()
-            if data == '0':
-                self.t = 1
-                self.signals.progress.emit(100)
-                self.logger.info("file {:d} '{:s}' is recorded".format(fileNumber, self.fileName))
-                self.dt2 = time.time() - self.dt1 - self.t0
-                self.signals.result.emit((self.dt1, self.dt2))
-                self.signals.finished.emit()
-                return
-            else:
-                percentVal = int(self.t*100/self.duraTime) if int(self.t*100/self.duraTime) < 99 else 99
-                self.signals.progress.emit(percentVal)
-                self.t += .1
-                QTimer.singleShot(100, loop_record)
-                
-        #print("IQR record start")
-
+    def record(self, fileNumber, triggered, stdscr):
+        '''
+        start the recording and poll the IQR until the file is completed, to be run on its I/O thread
+        fileNumber: number of the file, for the log
+        triggered:  callback function `triggered(preciseTimestamp)`, called as soon as the recording is started, or None
+        stdscr:     progress signal, -1 once armed, then the percentage
+        return the preparing and recording times [s]
+        '''
         self.write("TRIGger:RECorder:STARt")
         self.time_IQR_start = time.perf_counter() - self.time_IQR_ARMON # record the precise starting time of recording for one file (~micsec)
+        if triggered is not None:
+            # from now on, the IQR completes the file on its own, even if the DAQ dies
+            triggered(self.time_IQR_start)
         self.logger.debug('preparing, please wait...')
+        t0 = time.time()
 
-        self.t0 = time.time()
-        loop_arm()
-
-
-    def export(self, fileNumber):
-
-        def loop_wait(): # sponge time to wait for IQR wiping out its memory
-            self.write("SYSTem:ARCHive:RUNNing?")
-            data = self.read()
-            if data != '0':
-                loop_export()
-                return
-            else:
-                QTimer.singleShot(100, loop_wait)
-
-        def loop_export(): # exporting
-            self.write("SYSTem:ARCHive:PROGress?")
-            data = self.read()
-            percentVal = data.strip('"')[:-1] if data.strip('"') != '' else ' '
-            if data == '"100 %"':
-                self.signals.progress.emit(100)
-                self.dt = time.time() - self.t0
-                self.logger.info("file {:d} '{:s}' is exported".format(fileNumber, self.fileName))
-                self.signals.result.emit(self.dt)
-                self.signals.finished.emit()
-                return
-            else:
-                self.signals.progress.emit(int(percentVal))
-                QTimer.singleShot(100, loop_export)
-
-        #print("IQR export start")
+        # sponge time to wait for IQR arming
+        self.poll("STATus:RECorder?", lambda data: data == '1', timeout=self.armTimeout)
+        stdscr.emit(-1)
+        dt1 = time.time() - t0
+        self.logger.info("recording file {:d} '{:s}'".format(fileNumber, self.fileName))
+        self.logger.debug('estimated time of finish {:.2f} s'.format(self.duraTime))
 
+        def recorded(data):
+            if data == '0':
+                return True
+            stdscr.emit(min(int((time.time() - t0 - dt1) * 100 / self.duraTime), 99))
+            return False
+        self.poll("STATus:RECorder?", recorded, timeout=self.duraTime+self.recordMargin)
+        stdscr.emit(100)
+        self.logger.info("file {:d} '{:s}' is recorded".format(fileNumber, self.fileName))
+        return dt1, time.time() - t0 - dt1
+
+    def export(self, fileNumber, stdscr):
+        '''
+        export the recorded file to the mapped netdisk and poll the IQR until it is done, to be run on its I/O thread
+        fileNumber: number of the file, for the log
+        stdscr:     progress signal, -1 once started, then the percentage
+        return the exporting time [s]
+        '''
         self.write("SYSTem:ARCHive:SOURce:FILEname 'e:/" + self.fileName + "'")
         # the address of the netdisk 
         self.write("SYSTem:ARCHive:DESTination:FILEname 'y:/" + self.fileName + "'")
         self.write("SYSTem:ARCHive:FORMat RAW")
         self.write("SYSTem:ARCHive:STARt")
-        self.signals.progress.emit(-1)
+        stdscr.emit(-1)
         self.logger.debug("exporting file {:d} '{:s}', please wait...".format(fileNumber, self.fileName))
+        t0 = time.time()
+
+        # sponge time to wait for IQR wiping out its memory
+        self.archiveStarted(self.archiveTimeout)
 
-        self.t0 = time.time()
-        loop_wait()
+        def exported(data):
+            if data == '"100 %"':
+                return True
+            percentVal = data.strip('"')[:-1].strip()
+            if percentVal.isdigit():
+                stdscr.emit(int(percentVal))
+            return False
+        # a stalled export fails the file, which is left in the IQR for the next start
+        self.poll("SYSTem:ARCHive:PROGress?", exported, timeout=self.exportTimeout(self.fileSize)-(time.time()-t0))
+        stdscr.emit(100)
+        self.logger.info("file {:d} '{:s}' is exported".format(fileNumber, self.fileName))
+        return time.time() - t0
+
+    def archive(self, fileName, timeout=3600):
+        '''
+        export a file kept in the IQR by blocking until it is done, used for the recovery
+        fileName:   name of the file in the IQR
+        timeout:    maximum time to wait for the export [s]
+        '''
+        t0 = time.time()
+        self.write("SYSTem:ARCHive:SOURce:FILEname 'e:/" + fileName + "'")
+        self.write("SYSTem:ARCHive:DESTination:FILEname 'y:/" + fileName + "'")
+        self.write("SYSTem:ARCHive:FORMat RAW")
+        self.write("SYSTem:ARCHive:STARt")
+        self.logger.info("re-exporting file '{:s}', please wait...".format(fileName))
+        self.archiveStarted(min(self.archiveTimeout, timeout))
+        self.poll("SYSTem:ARCHive:PROGress?", lambda data: data == '"100 %"', timeout=timeout-(time.time()-t0))
+        self.logger.info("file '{:s}' is re-exported".format(fileName))
+        return time.time() - t0
 
 
 class DAQ_MainWindow(QMainWindow):
@@ -322,11 +479,230 @@ class DAQ_MainWindow(QMainWindow):
         # set folder address 
         #self.folder = "/home/schospec/Data/"
         self.folder = "/home/data/"
+        # the export engine, 'archive' for the IQR pushing to its mapped netdisk,
+        # or 'pull' for the server pulling from the IQR storage 'e:/' mounted at iqrShare
+        self.exportEngine = "archive"
+        self.iqrShare = "/mnt/iqr/"
+        self.pullStreams = 4
+        self.dataSuffix = ".wvd" # suffix of the RAW data files written by the IQR
+        # the quality check of every recorded file, and the policy on a bad file:
+        # 'continue' to raise the alarms only, 'skip' to keep it unexported in the IQR (with the 'pull' engine),
+        # 'stop' to end a run of maximum files
+        self.qualityCheck = True
+        self.qualityPolicy = "continue"
+        if self.qualityPolicy == "skip" and self.exportEngine != "pull":
+            # with the 'archive' engine, a file is only checked once exported, too late to keep it in the IQR
+            raise ValueError("quality policy 'skip' needs the 'pull' export engine")
+        self.quality = QualityMonitor()
+        # the optional down-conversion of every exported file into a reduced one, None to disable, e.g.
+        # {"offset": 0, "decimation": 10, "keep": True} for the sub-band [Hz] relative to the center frequency,
+        # the decimation factor, and whether to keep the full-rate file
+        self.reduction = None
+        # the adaptive sizing of the files within the limits of duration [s], None to keep the duration set, e.g.
+        # {"minimum": 5, "maximum": 60} to choose every file size for the largest fraction of time spent recording,
+        # and to defer to the end of the run the exports which would make a trigger be missed
+        self.adaptiveSizing = None
+        self.sizer = None
+        # the storage of the landing folder, with the policy on a low headroom for the next file:
+        # 'keep' to keep the file in the IQR, 'pause' to pause arming until space is freed,
+        # and the optional second tier where the older verified files are migrated to
+        self.storagePolicy = "keep"
+        self.tierFolder = None
+        self.storage = StorageManager(self.folder, self.tierFolder, dataSuffix=self.dataSuffix)
+        self.storage.start()
+        self.storagePaused = False
+
+        # set on exit to give up reconnecting the instruments
+        self.ioStopped = threading.Event()
+
+        # the record of the last FSVR calibration, reused on restart while valid
+        self.calibration = CalibrationCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.json"))
+
+        # the event stream of the acquisition, and the local network API serving it with the commands,
+        # to be opened to the network with the host "0.0.0.0" and a token for the commands
+        self.events = EventBus()
+        self.controlAddress = ("127.0.0.1", 8025)
+        self.controlToken = None
+        self.running = False
+        self.scanPlan = []
+
+        # the write-ahead journal of the acquisition, replayed to resume after a crash
+        self.journal = Journal(self.folder + "daq.journal")
+        self.fileNumber = self.journal.state["file number"] + 1
+        for entry in self.journal.pending("prepared"):
+            # the recording was never started, nothing is to be saved
+            self.phase("discarded", name=entry["name"])
+            logging.info("file {:d} '{:s}' is discarded as its recording was never started".format(entry["number"], entry["name"]))
+        self.recoverHeaders()
 
         self.initUI()
 
+        # the commands of the API are carried out on the GUI thread through a queued signal
+        self.commandSignals = WorkerSignals()
+        self.commandSignals.result.connect(self.command)
+        try:
+            self.control = ControlServer(self.events, self.commandSignals.result.emit, *self.controlAddress, token=self.controlToken)
+            self.control.start()
+        except OSError as error:
+            logging.getLogger("CTRL").warning("API fails to listen on {:s}:{:d}: {}".format(*self.controlAddress, error))
+
         logging.info("application starts\n")
 
+    def phase(self, event, **fields):
+        '''
+        journal a phase transition of the acquisition, then push it to the event stream
+        '''
+        self.journal.append(event, **fields)
+        if "name" in fields:
+            tracer.transition(fields["name"], event)
+        self.events.publish("phase", phase=event, **{key: value for key, value in fields.items() if key != "metadata"})
+
+    def command(self, command):
+        '''
+        carry out a command of the control API, the failures are pushed to the event stream
+        '''
+        try:
+            if command["command"] == "set":
+                self.setParameters(command["parameters"])
+            elif command["command"] == "start":
+                self.startAcquisition()
+            elif command["command"] == "stop":
+                self.scanPlan = []
+                self.stopAcquisition()
+            elif command["command"] == "scan":
+                if self.running:
+                    raise RuntimeError("data acquisition is running")
+                self.scanPlan = list(command["plan"])
+                self.scanNext()
+        except (ValueError, TypeError, RuntimeError) as error:
+            self.scanPlan = []
+            logging.getLogger("CTRL").warning("command '{:s}' fails: {}".format(command["command"], error))
+            self.events.publish("error", command=command["command"], message=str(error))
+
+    def setParameters(self, parameters):
+        '''
+        fill and lock the parameters as from the GUI
+        parameters: dict of 'center frequency' [MHz], 'span' [kHz], 'reference level' [dBm], 'duration' [s],
+                    'files' for the maximum files (0 for continuous collecting), 'mode' in 'auto' or 'manual'
+        '''
+        if self.running:
+            raise RuntimeError("data acquisition is running")
+        if not self.setButton.isEnabled():
+            raise RuntimeError("devices are not ready")
+        inputs = {
+                "center frequency": self.cenFreqInput,
+                "span": self.spanInput,
+                "reference level": self.refLevInput,
+                "duration": self.durationInput,
+                }
+        unknown = set(parameters) - set(inputs) - {"files", "mode"}
+        if unknown:
+            raise ValueError("unknown parameters {}".format(", ".join(sorted(unknown))))
+        values = {key: float(value) for key, value in parameters.items() if key in inputs}
+        if parameters.get("mode", "auto") not in ("auto", "manual"):
+            raise ValueError("mode must be 'auto' or 'manual'")
+        files = int(parameters.get("files", int(self.fileMaxNumInput.text()) if self.fileModecheck.isChecked() else 0))
+        if self.setButton.isChecked():
+            self.setButton.setChecked(False)
+        for key, value in values.items():
+            inputs[key].setText("{:g}".format(value))
+        self.fileModecheck.setChecked(files > 0)
+        if files > 0:
+            self.fileMaxNumInput.setText(str(files))
+        self.setButton.setChecked(True)
+        self.runModeButton.setChecked(parameters.get("mode", "manual" if self.runModeButton.isChecked() else "auto") == "manual")
+        self.events.publish("parameters", **{key: self.metadata[key] for key in ("center frequency", "span", "reference level", "duration")}, files=files)
+
+    def startAcquisition(self):
+        if self.running:
+            raise RuntimeError("data acquisition is running")
+        if not self.statusButton.isEnabled():
+            raise RuntimeError("parameters are not set")
+        self.statusButton.pressed.emit()
+
+    def stopAcquisition(self):
+        '''
+        stop the acquisition once the current file is completed
+        '''
+        if not self.running:
+            raise RuntimeError("data acquisition is not running")
+        if self.statusButton.isCheckable():
+            self.statusButton.pressed.emit()
+
+    def scanNext(self):
+        '''
+        run the next step of the scan, each step being a run of maximum files
+        '''
+        if not self.scanPlan:
+            return
+        step = self.scanPlan.pop(0)
+        self.events.publish("scan", step=step, remaining=len(self.scanPlan))
+        self.setParameters(step)
+        self.startAcquisition()
+
+    def writeHeader(self, fileName, metadata, stored=False):
+        '''
+        write the json header of a data file, `.bak.wvh` for a file stored in the IQR
+        '''
+        with open(self.folder + fileName + (".bak.wvh" if stored else ".wvh"), 'w') as header:
+            json.dump(metadata, header, indent=4, sort_keys=True)
+
+    def recoverHeaders(self):
+        '''
+        write the missing headers of the files which have been exported or stored before a crash
+        '''
+        for entry in self.journal.pending("exported", "stored"):
+            metadata = dict(entry["metadata"])
+            metadata["order in files"] = entry["order"]
+            metadata["precise timestamp"] = entry["precise timestamp"]
+            self.writeHeader(entry["name"], metadata, stored=entry["phase"]=="stored")
+            self.phase("header", name=entry["name"])
+            logging.info("header of file {:d} '{:s}' is recovered".format(entry["number"], entry["name"]))
+
+    def leftovers(self):
+        '''
+        return the files still to be exported, interrupted by a crash, failed or deferred
+        '''
+        return self.journal.pending("triggered", "recorded", "exporting", "deferred")
+
+    def recoverExports(self):
+        '''
+        export again the files whose export was interrupted by a crash or deferred, to be run with the IQR connected,
+        including the files triggered before a crash, which the IQR completes on its own
+        '''
+        for entry in self.leftovers():
+            if entry["phase"] == "triggered":
+                metadata = entry["metadata"]
+                try:
+                    self.iqr.poll("STATus:RECorder?", lambda data: data == '0', timeout=metadata["number of samples"]/metadata["sampling rate"]+self.iqr.recordMargin)
+                except Exception as error:
+                    logging.warning("file {:d} '{:s}' fails to be completed: {}".format(entry["number"], entry["name"], error))
+                    continue
+                self.phase("recorded", name=entry["name"])
+                logging.info("file {:d} '{:s}' is recovered as recorded by the IQR".format(entry["number"], entry["name"]))
+            if entry["metadata"]["number of samples"] > 2.5e8: # fileSize > 1G, store in the IQR
+                self.phase("stored", name=entry["name"])
+                continue
+            self.phase("exporting", name=entry["name"])
+            try:
+                if self.exportEngine == "pull":
+                    t0 = time.time()
+                    self.pull(entry["name"]).run()
+                    dt3 = time.time() - t0
+                else:
+                    dt3 = self.iqr.archive(entry["name"], self.iqr.exportTimeout(entry["metadata"]["number of samples"]))
+            except Exception as error:
+                logging.warning("file {:d} '{:s}' fails to be re-exported: {}".format(entry["number"], entry["name"], error))
+                continue
+            self.phase("exported", name=entry["name"], dt3=dt3)
+        self.recoverHeaders()
+
+    def pull(self, fileName, progress=None):
+        '''
+        return the engine pulling a data file from the mounted IQR storage into the storage folder
+        '''
+        return ParallelPull(self.iqrShare + fileName + self.dataSuffix, self.folder + fileName + self.dataSuffix, self.pullStreams, progress=progress)
+
     def QLineEdit_StopStyle(self, lineEdit):
         lineEdit.setStyleSheet(self.stop_style)
         lineEdit.setReadOnly(False)
@@ -345,12 +721,18 @@ class DAQ_MainWindow(QMainWindow):
         self.setStyleSheet("QLabel{{color: {0:s} }} QCheckBox{{background-color: {1:s}; color: {0:s}}} QTextEdit{{color: {0:s}}} QMainWindow{{ background-color: {1:s} }} QCentralWidget{{ background-color: {1:s} }} QGroupBox{{ background-color: {1:s} }}".format(self.fgcolor, self.bgcolor))
         
         self.threadPool = QThreadPool()
+        # each instrument connection is owned by its own long-lived I/O thread
+        self.fsvrIO = IOThread()
+        self.iqrIO = IOThread()
+        # the reductions are queued on their own thread, one file at a time, sharing one pool of processes
+        self.reductionIO = IOThread()
+        self.reductionPool = None
 
         self.setDisplayPanel()
         self.buildConnection()
 
         self.statusBar().setFont(self.fontStat)
-        self.statusBar().showMessage("set the parameters before run")
+        self.statusBar().showMessage("connecting the devices, please wait...")
 
     def setDisplayPanel(self):
         # set the FSVR status display
@@ -560,9 +942,11 @@ class DAQ_MainWindow(QMainWindow):
                 self.metadata["format"] = "int16"
                 self.metadata["endian"] = "little"
                 self.metadata["resolution"] = 16 # bits
-                self.FSVR_acquire_worker = Worker(self.fsvr.acquire, self.metadata["center frequency"], self.metadata["sampling rate"], self.metadata["reference level"])
+                self.FSVR_acquire_worker = Worker(self.fsvr.acquire, self.metadata["center frequency"], self.metadata["sampling rate"], self.metadata["reference level"], self.ioStopped)
                 self.FSVR_acquire_worker.signals.finished.connect(FSVR_acquire_ready)
-                self.IQR_init_worker = Worker(IQR_init_work, self.metadata["number of samples"], self.metadata["sampling rate"])
+                self.IQR_init_worker = Worker(IQR_init_work)
+                self.IQR_init_worker.signals.message.connect(IQR_status_message)
+                self.IQR_init_worker.signals.error.connect(lambda error: IQR_error("initialization", error))
                 self.IQR_init_worker.signals.finished.connect(IQR_init_ready_auto)
                 self.ArduinoTriggerStatus.setFormat("triggered")
                 self.ArduinoTriggerStatus.setStyleSheet(self.ready_style)
@@ -599,10 +983,25 @@ class DAQ_MainWindow(QMainWindow):
             self.statusButton.setChecked(True)
             self.statusButton.setIcon(self.iconPause)
             self.statusBar().showMessage("data acquisition running")
-            self.threadPool.start(self.FSVR_acquire_worker)
+            self.fsvrIO.start(self.FSVR_acquire_worker)
             #print("play")
-            self.TotalDt1 = self.TotalDt2 = self.TotalDt3 = 0
-            self.fileFixNumber = 1
+            parameters = {key: self.metadata[key] for key in ("center frequency", "span", "reference level", "duration")}
+            self.phase("run start", parameters=parameters)
+            run = self.journal.state["run"]
+            self.TotalDt1, self.TotalDt2, self.TotalDt3 = run["totals"]
+            self.fileFixNumber = run["order"]
+            self.qualityStop = False
+            self.fileEnd = None
+            if self.adaptiveSizing is not None:
+                SRat = self.metadata["sampling rate"]
+                self.sizer = AdaptiveSizer(self.adaptiveSizing["minimum"]*SRat, self.adaptiveSizing["maximum"]*SRat)
+            else:
+                self.sizer = None
+            self.running = True
+            self.events.publish("run", state="running", parameters=parameters, order=self.fileFixNumber)
+            if self.fileFixNumber > 1:
+                self.fileLogText.append("run resumed from file {:d} in order\n".format(self.fileFixNumber))
+                logging.info("run is resumed from file {:d} in order".format(self.fileFixNumber))
 
         def button_pause():
             if self.statusButton.isCheckable():
@@ -622,28 +1021,90 @@ class DAQ_MainWindow(QMainWindow):
 
         # build FSVR work
         def FSVR_init_work(stdscr):
-            #self.fsvr = FSVR("10.10.91.95")
-            #self.fsvr = FSVR("10.10.81.51")
-            self.fsvr = FSVR("192.168.31.107")
-        def FSVR_init_ready():
-            self.FSVRStatus.setFormat("running")
-            self.FSVRStatus.setStyleSheet(self.ready_style)
+            #self.fsvr = FSVR("10.10.91.95", self.calibration)
+            #self.fsvr = FSVR("10.10.81.51", self.calibration)
+            self.fsvr = FSVR("192.168.31.107", self.calibration)
+            return self.fsvr.calibrated
+        def FSVR_init_result(calibrated):
+            if calibrated:
+                self.FSVRStatus.setFormat("running")
+                self.FSVRStatus.setStyleSheet(self.ready_style)
+            else:
+                self.FSVRStatus.setFormat("calib failed")
+                self.FSVRStatus.setStyleSheet(self.unset_style)
+                self.statusBar().showMessage("FSVR calibration failed, please restart")
+        def FSVR_init_error(error):
+            self.FSVRStatus.setFormat("unconnected")
+            self.FSVRStatus.setStyleSheet(self.unset_style)
+            self.statusBar().showMessage("FSVR is unreachable, please restart")
+
+        # build IQR connection, opened at startup and kept for all the files
+        def IQR_connect_work(stdscr):
+            # a file triggered before a crash may still be being recorded, which a reset would cut
+            #self.iqr = IQR("10.10.91.93", reset=not self.journal.pending("triggered"))
+            self.iqr = IQR("192.168.31.100", reset=not self.journal.pending("triggered"))
+        def IQR_connect_ready(result):
+            self.IQRStatus.setFormat("connected")
+            self.IQRStatus.setStyleSheet(self.wait_style)
+            if self.leftovers():
+                leftover_export()
+        def IQR_connect_error(error):
+            self.IQRStatus.setFormat("unconnected")
+            self.IQRStatus.setStyleSheet(self.unset_style)
+            self.statusBar().showMessage("IQR is unreachable, please restart")
+
+        def leftover_export():
+            # the leftover exports are queued on the IQR I/O thread, ahead of any next file, without holding the GUI
+            count = len(self.leftovers())
+            self.fileLogText.append("exporting {:d} leftover file(s)...\n".format(count))
+            logging.info("{:d} leftover file(s) are to be exported".format(count))
+            self.leftover_worker = Worker(lambda stdscr: self.recoverExports())
+            self.leftover_worker.signals.error.connect(lambda error: logging.warning("leftover files fail to be exported: {}".format(error[1])))
+            self.leftover_worker.signals.finished.connect(lambda: self.fileLogText.append("{:d} leftover file(s) left\n".format(len(self.leftovers()))))
+            self.iqrIO.start(self.leftover_worker)
+
+        def devices_ready():
+            # unlock the parameters only when both of the devices are ready
+            self.devicesPending -= 1
+            if self.devicesPending > 0:
+                return
+            if not (getattr(self, "fsvr", None) and self.fsvr.calibrated and getattr(self, "iqr", None)):
+                return
             self.setButton.setEnabled(True)
             self.setButton.setChecked(False)
             self.QLineEdit_StopStyle(self.cenFreqInput)
             self.QLineEdit_StopStyle(self.spanInput)
             self.QLineEdit_StopStyle(self.refLevInput)
             self.QLineEdit_StopStyle(self.durationInput)
-        # start calibrating FSVR
+            self.statusBar().showMessage("set the parameters before run")
+
+        # start calibrating FSVR and connecting IQR in parallel
+        self.devicesPending = 2
         self.FSVR_init_worker = Worker(FSVR_init_work)
-        self.threadPool.start(self.FSVR_init_worker)
+        self.FSVR_init_worker.signals.result.connect(FSVR_init_result)
+        self.FSVR_init_worker.signals.error.connect(FSVR_init_error)
+        self.FSVR_init_worker.signals.finished.connect(devices_ready)
+        self.IQR_connect_worker = Worker(IQR_connect_work)
+        self.IQR_connect_worker.signals.result.connect(IQR_connect_ready)
+        self.IQR_connect_worker.signals.error.connect(IQR_connect_error)
+        self.IQR_connect_worker.signals.finished.connect(devices_ready)
+        self.fsvrIO.start(self.FSVR_init_worker)
+        self.iqrIO.start(self.IQR_connect_worker)
         self.FSVRStatus.setFormat("calibrating")
         self.FSVRStatus.setStyleSheet(self.wait_style)
-        QTimer.singleShot(12000, FSVR_init_ready)
+        self.IQRStatus.setFormat("connecting")
+        self.IQRStatus.setStyleSheet(self.wait_style)
+
+        def FSVR_check_work(stdscr):
+            return self.fsvr.ensure(self.ioStopped)
+        def FSVR_check_result(recovered):
+            if recovered:
+                self.fileLogText.append("FSVR connection is restored.\n")
+                self.events.publish("alarm", alarms=["FSVR connection restored"])
 
         def FSVR_acquire_ready():
             #print("FSVR: ready")
-            self.threadPool.start(self.IQR_init_worker)
+            IQR_arm()
 
         # build Arduino work
         def Arduino_work(stdscr):
@@ -665,11 +1126,14 @@ class DAQ_MainWindow(QMainWindow):
                         logging.getLogger("YUN").info("Arduino is triggered")
                         break
         def Arduino_ready():
+            tracer.instant("trigger", number=self.fileNumber)
+            if self.sizer is not None:
+                self.sizer.trigger()
+            self.events.publish("trigger", number=self.fileNumber)
             self.ArduinoTriggerStatus.setFormat("triggered")
             self.ArduinoTriggerStatus.setStyleSheet(self.ready_style)
-            # fileName setting
+            # the file name is kept as the one the IQR records to, only the trigger time is stamped
             timestamp = time.localtime()
-            self.fileName = time.strftime("%Y%m%d", timestamp) + "_" + time.strftime("%H%M%S", timestamp)
             self.metadata["timestamp"] = time.strftime("%Y", timestamp) + "-" +\
                                 time.strftime("%m", timestamp) + "-" +\
                                 time.strftime("%d", timestamp) + "T" +\
@@ -677,20 +1141,11 @@ class DAQ_MainWindow(QMainWindow):
                                 time.strftime("%M", timestamp) + ":" +\
                                 time.strftime("%S", timestamp) +\
                                 time.strftime("%z", timestamp)
-            self.currentFileNameLab.setText(self.fileName)
             self.currentFileLab.setText("collecting file # " + str(self.fileNumber))
-            self.thread_record.started.connect(lambda: self.iqr.record(self.fileNumber, self.fileName))
-            self.thread_record.finished.connect(IQR_record_ready)
-            #print("auto-connect")
-            self.iqr.signals.progress.connect(IQR_record_process)
-            self.iqr.signals.result.connect(IQR_record_result)
-            self.iqr.signals.finished.connect(self.thread_record.quit)
-            self.thread_record.start()
-            self.thread_export.started.connect(lambda: self.iqr.export(self.fileNumber, self.fileName))
-            self.thread_export.finished.connect(IQR_export_ready)
+            IQR_record_start()
 
         # build IQR work
-        def IQR_init_work(FileSize, SRat, stdscr):
+        def IQR_init_work(stdscr):
             #print("IQR: init start!")
             # fileName setting
             timestamp = time.localtime(time.time() + 10)
@@ -702,38 +1157,56 @@ class DAQ_MainWindow(QMainWindow):
                                 time.strftime("%M", timestamp) + ":" +\
                                 time.strftime("%S", timestamp) +\
                                 time.strftime("%z", timestamp)
-            self.currentFileNameLab.setText(self.fileName)
-            #self.iqr = IQR("10.10.91.93", FileSize, SRat, self.fileName)
-            self.iqr = IQR("192.168.31.100", FileSize, SRat, self.fileName)
+            # check the connection before every file, a lost one is recovered with its configuration
+            if not self.iqr.healthy():
+                self.IQR_init_worker.signals.message.emit("reconnecting")
+                self.iqr.recover(self.ioStopped)
+                self.IQR_init_worker.signals.message.emit("connected")
+            self.iqr.configure(self.metadata["number of samples"], self.metadata["sampling rate"], self.fileName)
+            self.phase("prepared", name=self.fileName, number=self.fileNumber, order=self.fileFixNumber, metadata=self.metadata)
         def IQR_init_ready_auto():
+            if self.fileFailed:
+                IQR_file_failed()
+                return
+            if self.sizer is not None and self.fileEnd is not None:
+                self.sizer.gap(time.time() - self.fileEnd)
             self.IQRStatus.setFormat("running")
             self.IQRStatus.setStyleSheet(self.ready_style)
+            self.currentFileNameLab.setText(self.fileName)
             self.Arduino_worker = Worker(Arduino_work)
             self.Arduino_worker.signals.finished.connect(Arduino_ready)
             self.ArduinoTriggerStatus.setFormat("waiting")
             self.ArduinoTriggerStatus.setStyleSheet(self.wait_style)
             QTimer.singleShot(2000, lambda: self.threadPool.start(self.Arduino_worker))
-            self.thread_record = QThread()
-            self.thread_export = QThread()
         def IQR_init_ready_manu():
+            if self.fileFailed:
+                IQR_file_failed()
+                return
+            if self.sizer is not None and self.fileEnd is not None:
+                self.sizer.gap(time.time() - self.fileEnd)
             self.IQRStatus.setFormat("running")
             self.IQRStatus.setStyleSheet(self.ready_style)
+            self.currentFileNameLab.setText(self.fileName)
             self.currentFileLab.setText("collecting file # " + str(self.fileNumber))
             logging.info("manual triggered")
-            self.thread_record = QThread()
-            self.thread_export = QThread()
-            self.thread_record.started.connect(lambda: self.iqr.record(self.fileNumber))
-            self.thread_record.finished.connect(IQR_record_ready)
-            #print("manu-connect")
-            self.iqr.signals.progress.connect(IQR_record_process)
-            self.iqr.signals.result.connect(IQR_record_result)
-            self.iqr.signals.finished.connect(self.thread_record.quit)
-            QTimer.singleShot(2000, self.thread_record.start)
-            self.thread_export.started.connect(lambda: self.iqr.export(self.fileNumber))
-            self.thread_export.finished.connect(IQR_export_ready)
+            QTimer.singleShot(2000, IQR_record_start)
             return
 
+        def IQR_record_start():
+            # the polling runs on the I/O thread of the IQR, the progress comes back through the queued signals
+            self.IQR_record_worker = Worker(self.iqr.record, self.fileNumber, IQR_triggered)
+            self.IQR_record_worker.signals.progress.connect(IQR_record_process)
+            self.IQR_record_worker.signals.result.connect(IQR_record_result)
+            self.IQR_record_worker.signals.error.connect(lambda error: IQR_error("recording", error))
+            self.IQR_record_worker.signals.finished.connect(IQR_record_ready)
+            self.iqrIO.start(self.IQR_record_worker)
+
+        def IQR_triggered(preciseTimestamp):
+            # called on the I/O thread, the journal is thread-safe
+            self.phase("triggered", name=self.fileName, **{"precise timestamp": preciseTimestamp})
+
         def IQR_record_process(percentVal):
+            self.events.publish("progress", stage="record", value=percentVal, number=self.fileNumber)
             if percentVal == -1:
                 self.IQRrecordStatus.setFormat("recording")
                 self.IQRrecordStatus.setValue(0)
@@ -748,20 +1221,56 @@ class DAQ_MainWindow(QMainWindow):
         def IQR_record_result(result):
             self.dt1, self.dt2 = result
         def IQR_record_ready():
-            self.iqr.signals.progress.disconnect(IQR_record_process)
-            self.iqr.signals.result.disconnect(IQR_record_result)
-            self.iqr.signals.finished.disconnect(self.thread_record.quit)
-            #print("record-disconnect")
-            self.iqr.signals.progress.connect(IQR_export_process)
-            self.iqr.signals.result.connect(IQR_export_result)
-            self.iqr.signals.finished.connect(self.thread_export.quit)
-            #print("export-connect")
-            if self.metadata["number of samples"] > 2.5e8: # fileSize > 1G, store in the IQR
+            if self.fileFailed:
+                IQR_file_failed()
+                return
+            self.phase("recorded", name=self.fileName, dt1=self.dt1, dt2=self.dt2, metadata=self.metadata, **{"precise timestamp": self.iqr.time_IQR_start})
+            self.fileStored = self.metadata["number of samples"] > 2.5e8
+            self.exportFailed = False
+            if not self.fileStored and not self.storage.enough(self.metadata["number of samples"]):
+                self.fileStored = True
+                self.fileLogText.append("file {:d}: {:s} kept in IQR for the low disk space.".format(self.fileNumber, self.fileName))
+                logging.getLogger("STOR").warning("file {:d} '{:s}' is kept in the IQR for {:.1f} GB free".format(self.fileNumber, self.fileName, self.storage.free()/1e9))
+            self.fileDeferred = False
+            if self.sizer is not None and not self.fileStored:
+                self.fileDeferred = not self.sizer.exportNow(self.metadata["number of samples"], self.metadata["sampling rate"], len(self.journal.pending("deferred")))
+                self.metadata["adaptive sizing"]["export"] = "deferred" if self.fileDeferred else "now"
+            self.metadata.pop("quality", None)
+            if self.qualityCheck and self.exportEngine == "pull":
+                # check the file on the mounted IQR storage before spending the export bandwidth, sparsely
+                quality_start(self.iqrShare + self.fileName + self.dataSuffix, 8, self.fileNumber, self.fileName, self.metadata, IQR_export_start)
+            else:
+                IQR_export_start()
+
+        def IQR_export_start():
+            if self.fileStored: # fileSize > 1G, store in the IQR
+                self.phase("stored", name=self.fileName)
+                IQR_export_ready()
+            elif self.fileDeferred:
+                # kept in the IQR, to be exported at the end of the run
+                self.phase("deferred", name=self.fileName, metadata=self.metadata)
+                self.dt3 = 0
                 IQR_export_ready()
+            elif self.exportEngine == "pull":
+                self.phase("exporting", name=self.fileName)
+                self.IQR_pull_worker = Worker(IQR_pull_work, self.fileName)
+                self.IQR_pull_worker.signals.progress.connect(IQR_export_process)
+                self.IQR_pull_worker.signals.message.connect(IQR_pull_rate)
+                self.IQR_pull_worker.signals.result.connect(IQR_export_result)
+                self.IQR_pull_worker.signals.error.connect(IQR_pull_error)
+                self.IQR_pull_worker.signals.finished.connect(IQR_export_done)
+                self.threadPool.start(self.IQR_pull_worker)
             else:
-                QTimer.singleShot(1000, self.thread_export.start)
+                self.phase("exporting", name=self.fileName)
+                self.IQR_export_worker = Worker(self.iqr.export, self.fileNumber)
+                self.IQR_export_worker.signals.progress.connect(IQR_export_process)
+                self.IQR_export_worker.signals.result.connect(IQR_export_result)
+                self.IQR_export_worker.signals.error.connect(IQR_export_error)
+                self.IQR_export_worker.signals.finished.connect(IQR_export_done)
+                QTimer.singleShot(1000, lambda: self.iqrIO.start(self.IQR_export_worker))
 
         def IQR_export_process(percentVal):
+            self.events.publish("progress", stage="export", value=percentVal, number=self.fileNumber)
             if percentVal == -1:
                 self.IQRexportStatus.setFormat("exporting")
                 self.IQRexportStatus.setValue(0)
@@ -775,72 +1284,258 @@ class DAQ_MainWindow(QMainWindow):
                 self.IQRexportStatus.setValue(percentVal)
         def IQR_export_result(result):
             self.dt3 = result
-        def IQR_export_ready():
-            time.sleep(1)
-            if self.metadata["number of samples"] > 2.5e8:
-                with open(self.folder + self.fileName + ".bak.wvh", 'w') as header:
-                    self.metadata["order in files"] = self.fileFixNumber
-                    self.metadata["precise timestamp"] = self.iqr.time_IQR_start
-                    json.dump(self.metadata, header, indent=4, sort_keys=True)
-                    self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nfile stored in IQR.".format(self.fileNumber, self.fileName, self.dt1, self.dt2))
-                    logging.info("preparing time: {:.2f} s\n{:25s} recording time: {:.2f} s\n".format(self.dt1, ' ', self.dt2))
 
+        # build IQR pull work, the alternative export engine
+        def IQR_pull_work(fileName, stdscr):
+            def report(done, total, rate):
+                stdscr.emit(int(done*100/total) if total > 0 else 100)
+                self.IQR_pull_worker.signals.message.emit("{:.1f} MB/s".format(rate))
+            stdscr.emit(-1)
+            t0 = time.time()
+            self.pull(fileName, report).run()
+            logging.getLogger("IQR").info("file {:d} '{:s}' is pulled".format(self.fileNumber, fileName))
+            return time.time() - t0
+        def IQR_pull_rate(rate):
+            if self.IQRexportStatus.value() < 100:
+                self.IQRexportStatus.setFormat("%p%  " + rate)
+        def IQR_export_error(error):
+            # the file stays in the IQR and in the journal as exporting, to be exported again on the next start
+            logging.getLogger("IQR").warning("file {:d} '{:s}' fails to be exported: {}".format(self.fileNumber, self.fileName, error[1]))
+            self.exportFailed = True
+            self.dt3 = 0
+        def IQR_pull_error(error):
+            # the file stays in the IQR and in the journal, the pulled chunks are kept to resume on the next start
+            logging.getLogger("IQR").warning("file {:d} '{:s}' fails to be pulled: {}".format(self.fileNumber, self.fileName, error[1]))
+            self.exportFailed = True
+            self.dt3 = 0
+        def IQR_export_done():
+            check = self.qualityCheck and not (self.fileStored or self.exportFailed or self.fileDeferred or "quality" in self.metadata)
+            number, name, metadata = self.fileNumber, self.fileName, self.metadata
+            IQR_export_ready()
+            if check:
+                # the exported file is checked while the next one is armed, its header is rewritten with the result
+                quality_start(self.folder + name + self.dataSuffix, 1, number, name, dict(metadata))
+
+        # build quality work
+        self.quality_workers = set()
+        def quality_start(fileName, stride, number, name, metadata, proceed=None):
+            '''
+            proceed:    the next step of the file, waiting for the check, None for a check in the background
+            '''
+            worker = Worker(quality_work, fileName, stride)
+            worker.signals.result.connect(lambda result: quality_result(result, number, name, metadata, proceed is not None))
+            worker.signals.error.connect(lambda error: quality_error(error, number, name))
+            # keep the workers referenced until they finish, as a background check may overlap the next file
+            self.quality_workers.add(worker)
+            worker.signals.finished.connect(lambda: self.quality_workers.discard(worker))
+            if proceed is not None:
+                worker.signals.finished.connect(proceed)
+            self.threadPool.start(worker)
+        def quality_work(fileName, stride, stdscr):
+            return self.quality.analyze(fileName, stride)
+        def quality_result(result, number, name, metadata, beforeExport):
+            metadata["quality"] = result
+            if not beforeExport:
+                self.writeHeader(name, metadata)
+            if result["alarms"]:
+                self.events.publish("alarm", name=name, number=number, verdict=result["verdict"], alarms=result["alarms"])
+                self.fileLogText.append("file {:d}: {:s} is {:s}\n! {:s}\n".format(number, name, result["verdict"], "\n! ".join(result["alarms"])))
+                self.statusBar().showMessage("quality alarm on file {:d}: {:s}".format(number, result["alarms"][0]))
+            if result["verdict"] != "bad":
+                return
+            if self.qualityPolicy == "skip" and beforeExport:
+                self.fileStored = True
+                logging.info("file {:d} '{:s}' is kept unexported in the IQR for its bad quality".format(number, name))
+            elif self.qualityPolicy == "stop" and self.fileModecheck.isChecked() and self.running:
+                # after an export, the check ends during the next file, which is the last one
+                self.qualityStop = True
+                logging.info("run is to be stopped for the bad quality of file {:d} '{:s}'".format(number, name))
+        def quality_error(error, number, name):
+            logging.getLogger("QUAL").warning("file {:d} '{:s}' fails to be checked: {}".format(number, name, error[1]))
+
+        # build reduction work, run in the background while the next file is acquired
+        self.reduction_workers = set()
+        def reduction_start(fileName, metadata):
+            worker = Worker(reduction_work, fileName, metadata, self.reduction.copy())
+            worker.signals.result.connect(lambda result: self.fileLogText.append("file {:s} is reduced to {:s}\n".format(fileName, result)))
+            worker.signals.error.connect(lambda error: logging.getLogger("DDC").warning("file '{:s}' fails to be reduced: {}".format(fileName, error[1])))
+            # keep the workers referenced until they finish, as several may be queued at the same time
+            self.reduction_workers.add(worker)
+            worker.signals.finished.connect(lambda: self.reduction_workers.discard(worker))
+            self.reductionIO.start(worker)
+        def reduction_work(fileName, metadata, reduction, stdscr):
+            # the pool is spawned with the first reduction, leaving a core to the acquisition
+            workers = max(os.cpu_count() - 1, 1)
+            if self.reductionPool is None:
+                self.reductionPool = process_pool(workers)
+            converter = DownConverter(metadata["sampling rate"], reduction["offset"], reduction["decimation"], workers=workers)
+            reducedName = fileName + ".ddc"
+            converter.run(self.folder + fileName + self.dataSuffix, self.folder + reducedName + self.dataSuffix, pool=self.reductionPool)
+            self.writeHeader(reducedName, converter.header(metadata, fileName))
+            if not reduction.get("keep", True):
+                os.remove(self.folder + fileName + self.dataSuffix)
+            return reducedName
+
+        def IQR_export_ready():
+            self.metadata["order in files"] = self.fileFixNumber
+            self.metadata["precise timestamp"] = self.iqr.time_IQR_start
+            if self.fileStored:
+                self.writeHeader(self.fileName, self.metadata, stored=True)
+                self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nfile stored in IQR.".format(self.fileNumber, self.fileName, self.dt1, self.dt2))
+                logging.info("preparing time: {:.2f} s\n{:25s} recording time: {:.2f} s\n".format(self.dt1, ' ', self.dt2))
+            elif self.exportFailed:
+                self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nexport failed, to be retried on the next start.\n".format(self.fileNumber, self.fileName, self.dt1, self.dt2))
+                logging.warning("file {:d} '{:s}' fails to be exported\n".format(self.fileNumber, self.fileName))
+            elif self.fileDeferred:
+                self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nexport deferred to the end of the run.\n".format(self.fileNumber, self.fileName, self.dt1, self.dt2))
+                logging.info("preparing time: {:.2f} s\n{:25s} recording time: {:.2f} s\n".format(self.dt1, ' ', self.dt2))
             else:
-                with open(self.folder + self.fileName + ".wvh", 'w') as header:
-                    self.metadata["order in files"] = self.fileFixNumber
-                    self.metadata["precise timestamp"] = self.iqr.time_IQR_start
-                    json.dump(self.metadata, header, indent=4, sort_keys=True)
-                    self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nexporting time: {:.2f} s\n".format(self.fileNumber, self.fileName, self.dt1, self.dt2, self.dt3))
-                    logging.info("preparing time: {:.2f} s\n{:25s} recording time: {:.2f} s\n{:25s} exporting time: {:.2f} s\n".format(self.dt1, ' ', self.dt2, ' ', self.dt3))
-            #print("export-disconnect")
-            self.iqr.signals.progress.disconnect(IQR_export_process)
-            self.iqr.signals.result.disconnect(IQR_export_result)
-            self.iqr.signals.finished.disconnect(self.thread_export.quit)
+                self.phase("exported", name=self.fileName, dt3=self.dt3)
+                self.writeHeader(self.fileName, self.metadata)
+                if self.reduction is not None:
+                    reduction_start(self.fileName, dict(self.metadata))
+                self.fileLogText.append("file {:d}: {:s}\npreparing time: {:.2f} s\nrecording time: {:.2f} s\nexporting time: {:.2f} s\n".format(self.fileNumber, self.fileName, self.dt1, self.dt2, self.dt3))
+                logging.info("preparing time: {:.2f} s\n{:25s} recording time: {:.2f} s\n{:25s} exporting time: {:.2f} s\n".format(self.dt1, ' ', self.dt2, ' ', self.dt3))
+            if not (self.exportFailed or self.fileDeferred):
+                self.phase("header", name=self.fileName)
+            dt3 = None if self.fileStored or self.exportFailed or self.fileDeferred else self.dt3
+            self.events.publish("timings", name=self.fileName, number=self.fileNumber, dt1=self.dt1, dt2=self.dt2, dt3=dt3)
+            # one structured line per file, for the capacity planner
+            logging.info("timings " + json.dumps({"name": self.fileName, "number of samples": self.metadata["number of samples"], "sampling rate": self.metadata["sampling rate"],
+                "dt1": self.dt1, "dt2": self.dt2, "dt3": dt3, "stored": self.fileStored}))
+            if self.sizer is not None:
+                self.sizer.observe(self.metadata["number of samples"], self.metadata["sampling rate"], self.dt1, self.dt2, dt3)
             self.IQRrecordStatus.setFormat("unrecorded")
             self.IQRrecordStatus.setStyleSheet(self.default_style)
             self.IQRexportStatus.setFormat("unexported")
             self.IQRexportStatus.setStyleSheet(self.default_style)
-            self.iqr.disconnect()
-            self.IQRStatus.setFormat("unset")
-            self.IQRStatus.setStyleSheet(self.unset_style)
+            self.IQRStatus.setFormat("connected")
+            self.IQRStatus.setStyleSheet(self.wait_style)
             self.fileNumber += 1
             self.fileFixNumber += 1
             self.TotalDt1 += self.dt1
             self.TotalDt2 += self.dt2
-            if self.metadata["number of samples"] > 2.5e8:
+            if self.fileStored:
                 self.TotalDt3 += 0
             else:
                 self.TotalDt3 += self.dt3
-            if (not self.statusButton.isCheckable()) or (self.fileModecheck.isChecked() and self.fileFixNumber >= (int(self.fileMaxNumInput.text())+1)):
-                self.fileLogText.append("total preparing time: {:.2f} s\ntotal recording time: {:.2f} s\ntotal exporting time: {:.2f} s\n\n".format(self.TotalDt1, self.TotalDt2, self.TotalDt3))
-                logging.info("total preparing time: {:.2f} s\n{:25s} total recording time: {:.2f} s\n{:25s} total exporting time: {:.2f} s\n\n".format(self.TotalDt1, ' ', self.TotalDt2, ' ', self.TotalDt3))
-                self.fileModecheck.setEnabled(True)
-                self.setButton.setEnabled(True)
-                self.setButton.setChecked(False)
-                self.runModeButton.setEnabled(False)
-                self.runModeButton.setChecked(False)
-                self.statusButton.setEnabled(False)
-                self.statusButton.setIcon(self.iconStart)
-                self.QLineEdit_StopStyle(self.cenFreqInput)
-                self.QLineEdit_StopStyle(self.spanInput)
-                self.QLineEdit_StopStyle(self.refLevInput)
-                self.QLineEdit_StopStyle(self.durationInput)
-                if self.fileModecheck.isChecked():
-                    self.QLineEdit_StopStyle(self.fileMaxNumInput)
-                    self.statusButton.setCheckable(False)
-                else:
-                    self.QLineEdit_SetupStyle(self.fileMaxNumInput)
-                self.statusBar().showMessage("data acquisition stopped")
-                if self.exit:
-                    logging.info("application stops\n\n\n")
-                    sys.exit()
+            IQR_next()
+
+        def IQR_error(stage, error):
+            # the current file fails, the connection is checked and recovered before the next one
+            self.fileFailed = "{:s} failed: {}".format(stage, error[1])
+            logging.getLogger("IQR").warning("file {:d} '{:s}' fails on {:s}: {}".format(self.fileNumber, self.fileName, stage, error[1]))
+        def IQR_status_message(message):
+            self.IQRStatus.setFormat(message)
+            self.IQRStatus.setStyleSheet(self.unset_style if message == "reconnecting" else self.wait_style)
+            if message == "reconnecting":
+                self.statusBar().showMessage("IQR connection lost, reconnecting...")
+                self.events.publish("alarm", alarms=["IQR connection lost"])
+            else:
+                self.statusBar().showMessage("data acquisition running")
+        def IQR_file_failed():
+            # nothing of the failed file is kept, it is neither counted in order nor in the totals
+            self.phase("discarded", name=self.fileName)
+            self.fileLogText.append("file {:d}: {:s}\n{:s}, file discarded.\n".format(self.fileNumber, self.fileName, self.fileFailed))
+            self.events.publish("alarm", name=self.fileName, number=self.fileNumber, alarms=[self.fileFailed])
+            self.IQRrecordStatus.setFormat("unrecorded")
+            self.IQRrecordStatus.setStyleSheet(self.default_style)
+            self.IQRexportStatus.setFormat("unexported")
+            self.IQRexportStatus.setStyleSheet(self.default_style)
+            self.IQRStatus.setFormat("connected")
+            self.IQRStatus.setStyleSheet(self.wait_style)
+            self.ArduinoTriggerStatus.setFormat("disabled" if self.runModeButton.isChecked() else "triggered")
+            self.ArduinoTriggerStatus.setStyleSheet(self.disable_style if self.runModeButton.isChecked() else self.ready_style)
+            IQR_next()
+
+        def IQR_next():
+            self.fileEnd = time.time()
+            if (not self.statusButton.isCheckable()) or (self.fileModecheck.isChecked() and (self.fileFixNumber >= (int(self.fileMaxNumInput.text())+1) or self.qualityStop)):
+                acquisition_stop()
             else:
-                self.IQR_init_worker = Worker(IQR_init_work, self.metadata["number of samples"], self.metadata["sampling rate"])
+                self.IQR_init_worker = Worker(IQR_init_work)
+                self.IQR_init_worker.signals.message.connect(IQR_status_message)
+                self.IQR_init_worker.signals.error.connect(lambda error: IQR_error("initialization", error))
                 if self.runModeButton.isChecked():
                     self.IQR_init_worker.signals.finished.connect(IQR_init_ready_manu)
                 else:
                     self.IQR_init_worker.signals.finished.connect(IQR_init_ready_auto)
-                self.threadPool.start(self.IQR_init_worker)
+                # let the IQR settle for a second before arming the next file, without blocking the GUI
+                QTimer.singleShot(1000, IQR_arm)
+
+        def sizing_choose():
+            # the size of the next file, recorded with the reasons of the choice in its header
+            SRat = self.metadata["sampling rate"]
+            nSamples, fraction = self.sizer.choose(SRat, number_of_samples(SRat, self.metadata["duration"]), len(self.journal.pending("deferred")))
+            self.metadata["number of samples"] = nSamples
+            self.metadata["adaptive sizing"] = {
+                    "duration": nSamples / SRat, # s
+                    "limits": [self.sizer.minSamples, self.sizer.maxSamples],
+                    "expected recording fraction": fraction,
+                    "trigger interval": self.sizer.interval, # s
+                    }
+        def IQR_arm():
+            if self.sizer is not None:
+                sizing_choose()
+            # pause arming while the landing disk is short of space, the migration may free some
+            if self.storage.critical() or (self.storagePolicy == "pause" and not self.storage.enough(self.metadata["number of samples"])):
+                if not self.statusButton.isCheckable():
+                    # stopped by the user during the pause
+                    self.storagePaused = False
+                    acquisition_stop()
+                    return
+                if not self.storagePaused:
+                    self.storagePaused = True
+                    self.statusBar().showMessage("data acquisition paused, {:.1f} GB free in {:s}".format(self.storage.free()/1e9, self.folder))
+                    logging.getLogger("STOR").warning("arming is paused for {:.1f} GB free".format(self.storage.free()/1e9))
+                    self.events.publish("alarm", alarms=["arming paused for low disk space"], free=self.storage.free())
+                QTimer.singleShot(10000, IQR_arm)
+                return
+            if self.storagePaused:
+                self.storagePaused = False
+                self.statusBar().showMessage("data acquisition running")
+                logging.getLogger("STOR").info("arming is resumed")
+            self.fileFailed = None
+            self.iqrIO.start(self.IQR_init_worker)
+            # meanwhile, the FSVR connection is checked on its own thread, and its acquisition restored if lost
+            self.FSVR_check_worker = Worker(FSVR_check_work)
+            self.FSVR_check_worker.signals.result.connect(FSVR_check_result)
+            self.FSVR_check_worker.signals.error.connect(lambda error: logging.getLogger("FSVR").warning("health check fails: {}".format(error[1])))
+            self.fsvrIO.start(self.FSVR_check_worker)
+
+        def acquisition_stop():
+            byUser = not self.statusButton.isCheckable()
+            self.fileLogText.append("total preparing time: {:.2f} s\ntotal recording time: {:.2f} s\ntotal exporting time: {:.2f} s\n\n".format(self.TotalDt1, self.TotalDt2, self.TotalDt3))
+            logging.info("total preparing time: {:.2f} s\n{:25s} total recording time: {:.2f} s\n{:25s} total exporting time: {:.2f} s\n\n".format(self.TotalDt1, ' ', self.TotalDt2, ' ', self.TotalDt3))
+            self.phase("run stop")
+            self.fileModecheck.setEnabled(True)
+            self.setButton.setEnabled(True)
+            self.setButton.setChecked(False)
+            self.runModeButton.setEnabled(False)
+            self.runModeButton.setChecked(False)
+            self.statusButton.setEnabled(False)
+            self.statusButton.setIcon(self.iconStart)
+            self.QLineEdit_StopStyle(self.cenFreqInput)
+            self.QLineEdit_StopStyle(self.spanInput)
+            self.QLineEdit_StopStyle(self.refLevInput)
+            self.QLineEdit_StopStyle(self.durationInput)
+            if self.fileModecheck.isChecked():
+                self.QLineEdit_StopStyle(self.fileMaxNumInput)
+                self.statusButton.setCheckable(False)
+            else:
+                self.QLineEdit_SetupStyle(self.fileMaxNumInput)
+            self.statusBar().showMessage("data acquisition stopped")
+            self.running = False
+            self.events.publish("run", state="stopped", totals=[self.TotalDt1, self.TotalDt2, self.TotalDt3])
+            if self.exit:
+                logging.info("application stops\n\n\n")
+                sys.exit()
+            if self.journal.pending("deferred"):
+                leftover_export()
+            if byUser:
+                self.scanPlan = []
+            elif self.scanPlan:
+                QTimer.singleShot(0, lambda: self.command({"command": "scan", "plan": self.scanPlan}))
 
 
     def keyPressEvent(self, event):
@@ -864,6 +1559,9 @@ class DAQ_MainWindow(QMainWindow):
         if reply == QMessageBox.Yes:
             subprocess.call("rm -f {:s}*.wsm".format(self.folder), shell=True)
             logging.info("application force stop\n\n\n")
+            self.ioStopped.set()
+            if self.reductionPool is not None:
+                self.reductionPool.shutdown(wait=False, cancel_futures=True)
             try:
                 self.iqr.disconnect()
             except:
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a write-ahead journal of the acquisition, to survive a crash of the DAQ.
+Every phase transition of a file is appended as one json line and fsync'd before the acquisition goes on,
+so that on restart the journal can be replayed to resume the file numbering and the run totals,
+and to tell which files still have to be exported or lack their `.wvh` header.
+The journal is compacted into a single checkpoint on opening (and every `compactEvery` records),
+which only keeps the unfinished files, hence the recovery time does not grow with the number of files.
+
+Phases of a file:
+    prepared:   the IQR is configured for the file
+    triggered:  the recording is started, the IQR completes it on its own
+    recorded:   the recording is completed, with the timings
+    exporting:  the export to the server is started
+    exported:   the data file is on the server
+    stored:     the data file is kept in the IQR
+    deferred:   the data file is kept in the IQR, to be exported at the end of the run
+    header:     the `.wvh` header is written, the file is finished
+    discarded:  the file is given up
+'''
+
+import os, time, json, copy, logging, threading
+
+
+class Journal():
+    '''
+    an append-only json-lines journal, replayed into `state` on opening
+    '''
+
+    def __init__(self, fileName, compactEvery=1000):
+        '''
+        fileName:       path of the journal file
+        compactEvery:   number of appended records before the journal is compacted again
+        '''
+        self.fileName = fileName
+        self.compactEvery = compactEvery
+        self.logger = logging.getLogger("JRNL")
+        self.lock = threading.Lock()
+        self.state = {
+                "file number": 0, # number of the last recorded file
+                "run": None, # unfinished run, {"order": next order in files, "totals": [dt1, dt2, dt3], "parameters": {...}, "id": time of its start}
+                "files": {}, # unfinished files, by name
+                }
+        self.replay()
+        self.compact()
+
+    def replay(self):
+        '''
+        rebuild the state from the journal on disk, a torn last line from a crash is ignored
+        '''
+        try:
+            with open(self.fileName, 'r') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        self.logger.warning("skip a torn journal record")
+                        continue
+                    self.apply(record)
+        except FileNotFoundError:
+            pass
+        if self.state["files"] or self.state["run"]:
+            self.logger.info("resume from file {:d} with {:d} unfinished file(s)".format(self.state["file number"], len(self.state["files"])))
+
+    def apply(self, record):
+        '''
+        update the state with one journal record
+        '''
+        event = record["event"]
+        files = self.state["files"]
+        if event == "checkpoint":
+            self.state = copy.deepcopy(record["state"])
+        elif event == "run start":
+            # a run interrupted by a crash is resumed only with the same parameters
+            run = self.state["run"]
+            if run is None or run.get("parameters") != record.get("parameters"):
+                self.state["run"] = {"order": 1, "totals": [0, 0, 0], "parameters": record.get("parameters"), "id": record.get("time")}
+        elif event == "run stop":
+            self.state["run"] = None
+        elif event == "prepared":
+            files[record["name"]] = {key: record[key] for key in ("name", "number", "order", "metadata")}
+            files[record["name"]]["phase"] = event
+            files[record["name"]]["run"] = None if self.state["run"] is None else self.state["run"].get("id")
+        elif record.get("name") not in files:
+            return
+        elif event == "discarded":
+            entry = files.pop(record["name"])
+            if self.inRun(entry) and self.state["run"]["order"] == entry["order"] + 1:
+                # the order of a file given up is taken by the next one
+                self.state["run"]["order"] = entry["order"]
+        elif event == "header":
+            entry = files.pop(record["name"])
+            if self.inRun(entry):
+                timings = (entry.get("dt1", 0), entry.get("dt2", 0), entry.get("dt3", 0))
+                self.state["run"]["totals"] = [total + dt for total, dt in zip(self.state["run"]["totals"], timings)]
+        else:
+            entry = files[record["name"]]
+            entry["phase"] = event
+            entry.update({key: value for key, value in record.items() if key not in ("event", "time")})
+            if event in ("triggered", "recorded"):
+                self.state["file number"] = max(self.state["file number"], entry["number"])
+                # the order is taken once recorded, the export and the header of the file may come later
+                if self.inRun(entry):
+                    self.state["run"]["order"] = max(self.state["run"]["order"], entry["order"] + 1)
+
+    def inRun(self, entry):
+        '''
+        whether the file belongs to the current run, rather than to a run left unfinished before it
+        '''
+        return self.state["run"] is not None and entry.get("run") == self.state["run"].get("id")
+
+    def append(self, event, **fields):
+        '''
+        apply a record to the state and persist it before returning
+        '''
+        line = json.dumps(dict(fields, event=event, time=time.time()), sort_keys=True)
+        with self.lock:
+            # apply a copy decoded from the line, so that the state is detached from the caller's objects
+            self.apply(json.loads(line))
+            with open(self.fileName, 'a') as journal:
+                journal.write(line + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.count += 1
+            if self.count >= self.compactEvery:
+                self._compact()
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        '''
+        atomically replace the journal with one checkpoint of the current state
+        '''
+        record = {"event": "checkpoint", "time": time.time(), "state": self.state}
+        with open(self.fileName + ".tmp", 'w') as journal:
+            journal.write(json.dumps(record, sort_keys=True) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(self.fileName + ".tmp", self.fileName)
+        self.count = 0
+
+    def pending(self, *phases):
+        '''
+        return the unfinished files in any of `phases`, by their order of recording
+        '''
+        with self.lock:
+            entries = [copy.deepcopy(entry) for entry in self.state["files"].values() if entry["phase"] in phases]
+        return sorted(entries, key=lambda entry: entry["number"])
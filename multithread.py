@@ -10,7 +10,9 @@ To use, import it into an empty script and sub-class QMainWindow for the GUI fro
 '''
 
 import traceback, sys
-from PyQt5.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+from tracing import tracer
 
 
 class Worker(QRunnable):
@@ -38,7 +40,8 @@ class Worker(QRunnable):
         initialize the runner function with passed args and kwargs
         '''
         try:
-            result = self.func(*self.args, **self.kwargs)
+            with tracer.span(getattr(self.func, "__name__", "worker"), "worker"):
+                result = self.func(*self.args, **self.kwargs)
         except:
             traceback.print_exc()
             exctype, value = sys.exc_info()[:2]
@@ -49,6 +52,20 @@ class Worker(QRunnable):
             self.signals.finished.emit()
 
 
+class IOThread(QThreadPool):
+    '''
+    the long-lived thread which owns the connection of one instrument and all its polling,
+    the workers started on it are run one after another, so that the commands are never interleaved,
+    and their results reach the GUI only through the queued signals
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.setMaxThreadCount(1)
+        # the thread never expires, so that it is not re-created for every file
+        self.setExpiryTimeout(-1)
+
+
 class WorkerSignals(QObject):
     '''
     Define the signals available from a running worker thread.
@@ -56,9 +73,12 @@ class WorkerSignals(QObject):
         finished:   `none`, empty
         result:     `object`, anything returned from processing
         error:      `tuple`, (exctype, value, traceback.format_exc() )
+        progress:   `int`, percentage of the progress
+        message:    `str`, any text to be displayed
     '''
 
     finished = pyqtSignal()
     result   = pyqtSignal("PyQt_PyObject")
     progress = pyqtSignal(int)
+    message  = pyqtSignal(str)
     error    = pyqtSignal(tuple)
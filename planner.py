@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a capacity planner, to choose the settings of a beam time before the beam arrives.
+It replays the timings of the past files, from the `daq.log` entries of the preparing/recording/exporting times
+(with the `.wvh` headers for their numbers of samples and sampling rates), from the structured 'timings' log lines,
+and from the records still in `daq.journal`. Then it fits a cost model of each phase:
+    prepare:    a + b * number of samples
+    record:     a + b * number of samples / sampling rate
+    export:     a + b * number of samples
+plus the overhead of a file cycle between the phases, measured from the intervals between consecutive files.
+With these models, a proposed run plan is simulated to predict the files per hour, the dead-time fraction,
+the disk usage and the backlog of the files kept in the IQR.
+To compare the durations 5, 10 and 20 s of a 500 kHz span, run
+    `python3 planner.py daq.log --headers /home/data/ --span 500 --duration 5 10 20 --files 100`
+'''
+
+import os, re, json, time, argparse
+
+import numpy as np
+
+
+BLOCK = 2621440 # granularity of the number of samples in the IQR
+STORE_LIMIT = 2.5e8 # number of samples from which a file is stored in the IQR
+
+
+def number_of_samples(SRat, duration):
+    '''
+    number of samples of a file, as rounded up by the DAQ
+    '''
+    return (int(SRat * duration / BLOCK) + 1) * BLOCK
+
+
+class History():
+    '''
+    collect the timings of the past files, by file name
+    '''
+
+    LINE = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (\S+)\s+(.*)$")
+    RECORDING = re.compile(r"recording file (\d+) '([^']+)'")
+    TIMINGS = re.compile(r"preparing time: ([\d.]+) s")
+    STRUCTURED = re.compile(r"timings (\{.*\})$")
+
+    def __init__(self, headers=None):
+        '''
+        headers: folder of the `.wvh` headers, to look up the settings of the files in the plain log entries
+        '''
+        self.headers = headers
+        self.files = {}
+
+    def header(self, name):
+        if self.headers is None:
+            return {}
+        for suffix in (".wvh", ".bak.wvh"):
+            try:
+                with open(os.path.join(self.headers, name + suffix), 'r') as header:
+                    return json.load(header)
+            except (OSError, ValueError):
+                continue
+        return {}
+
+    def add(self, name, **fields):
+        entry = self.files.setdefault(name, {"name": name})
+        entry.update({key: value for key, value in fields.items() if value is not None})
+
+    def readLog(self, fileName):
+        '''
+        parse the log entries, the continuation lines of a multi-line message are folded into it
+        '''
+        name, run = None, 0
+        entries = []
+        with open(fileName, 'r', errors="replace") as log:
+            for line in log:
+                match = self.LINE.match(line)
+                if match:
+                    entries.append([match.group(1), match.group(2), match.group(3)])
+                elif entries and line.strip():
+                    entries[-1][2] += '\n' + line.strip()
+        for stamp, logger, message in entries:
+            end = time.mktime(time.strptime(stamp, "%Y-%m-%d %H:%M:%S"))
+            if message.startswith("application") or message.startswith("total preparing time"):
+                # a new run, the interval to the previous file is not a file cycle
+                run += 1
+                name = None
+                continue
+            match = self.STRUCTURED.search(message)
+            if match:
+                try:
+                    record = json.loads(match.group(1))
+                except ValueError:
+                    continue
+                self.add(record.pop("name"), end=end, run=run, **record)
+                name = None
+                continue
+            match = self.RECORDING.search(message)
+            if match:
+                name = match.group(2)
+                continue
+            match = self.TIMINGS.match(message)
+            if match and name is not None:
+                timings = dict(re.findall(r"(preparing|recording|exporting) time: ([\d.]+) s", message))
+                header = self.header(name)
+                self.add(name, end=end, run=run,
+                        dt1=float(timings["preparing"]),
+                        dt2=float(timings["recording"]),
+                        dt3=float(timings["exporting"]) if "exporting" in timings else None,
+                        stored="exporting" not in timings,
+                        **{key: header.get(key) for key in ("number of samples", "sampling rate")})
+                name = None
+
+    def readJournal(self, fileName):
+        '''
+        parse the records of the journal, the ones of the finished files only remain until the next compaction
+        '''
+        with open(fileName, 'r') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("event") == "recorded":
+                    metadata = record.get("metadata", {})
+                    self.add(record["name"], dt1=record.get("dt1"), dt2=record.get("dt2"),
+                            **{key: metadata.get(key) for key in ("number of samples", "sampling rate")})
+                elif record.get("event") == "exported":
+                    self.add(record["name"], dt3=record.get("dt3"), stored=False)
+                elif record.get("event") == "stored":
+                    self.add(record["name"], stored=True)
+
+    def complete(self):
+        '''
+        return the files with their settings and timings, by time of completion
+        '''
+        files = [entry for entry in self.files.values() if all(key in entry for key in ("number of samples", "sampling rate", "dt1", "dt2"))]
+        return sorted(files, key=lambda entry: entry.get("end", 0))
+
+
+class PhaseModel():
+    '''
+    a linear cost model of one phase, `a + b * x` by least squares
+    '''
+
+    def __init__(self, phase, feature, single="proportional"):
+        '''
+        phase:      key of the timing, 'dt1', 'dt2' or 'dt3'
+        feature:    function `feature(nSamples, SRat)` of the variable
+        single:     'constant' or 'proportional', the model of a history with a single setting,
+                    which cannot tell the constant from the slope
+        '''
+        self.phase = phase
+        self.feature = feature
+        self.single = single
+        self.coef = (0., 0.)
+        self.rms = None
+        self.count = 0
+
+    def fit(self, files):
+        files = [entry for entry in files if entry.get(self.phase) is not None]
+        self.count = len(files)
+        if not files:
+            return self
+        x = np.array([self.feature(entry["number of samples"], entry["sampling rate"]) for entry in files], dtype=float)
+        y = np.array([entry[self.phase] for entry in files], dtype=float)
+        if len(np.unique(x)) >= 2:
+            A = np.vstack([np.ones_like(x), x]).T
+            self.coef = tuple(float(c) for c in np.linalg.lstsq(A, y, rcond=None)[0])
+        elif self.single == "proportional" and x[0] > 0:
+            self.coef = (0., float(y.mean() / x[0]))
+        else:
+            self.coef = (float(y.mean()), 0.)
+        self.rms = float(np.sqrt(np.mean((y - self.predict_x(x))**2)))
+        return self
+
+    def predict_x(self, x):
+        return np.maximum(self.coef[0] + self.coef[1] * x, 0)
+
+    def predict(self, nSamples, SRat):
+        return float(self.predict_x(self.feature(nSamples, SRat)))
+
+
+class Planner():
+    '''
+    fit the cost models on the history, and simulate the run plans
+    '''
+
+    def __init__(self, files, overhead=5.):
+        '''
+        files:      the past files, as returned by `History.complete`
+        overhead:   cycle overhead [s] when it cannot be measured
+        '''
+        self.files = files
+        self.models = {
+                "prepare": PhaseModel("dt1", lambda nSamples, SRat: nSamples, "constant").fit(files),
+                "record": PhaseModel("dt2", lambda nSamples, SRat: nSamples / SRat).fit(files),
+                "export": PhaseModel("dt3", lambda nSamples, SRat: nSamples).fit([entry for entry in files if not entry.get("stored")]),
+                }
+        self.overhead = self.measureOverhead(overhead)
+
+    def measureOverhead(self, default):
+        '''
+        the median time of a cycle outside of the timed phases (arming delays, settling, headers),
+        from the consecutive files of a same run
+        '''
+        gaps = []
+        for previous, entry in zip(self.files, self.files[1:]):
+            if "end" not in previous or "end" not in entry or previous.get("run") != entry.get("run"):
+                continue
+            gap = entry["end"] - previous["end"] - entry["dt1"] - entry["dt2"] - (entry.get("dt3") or 0)
+            if gap >= 0:
+                gaps.append(gap)
+        return float(np.median(gaps)) if gaps else default
+
+    def simulate(self, span, duration, files, trigger=None, free=None, iqrCapacity=None):
+        '''
+        span:           span [kHz]
+        duration:       duration of one file [s]
+        files:          number of files in the run
+        trigger:        interval between the triggers [s], None for the manual mode
+        free:           free space in the landing folder [byte], None for unlimited
+        iqrCapacity:    capacity of the IQR storage [byte], None for unlimited
+        return the prediction of the run
+        '''
+        SRat = span * 1e3 * 1.25
+        nSamples = number_of_samples(SRat, duration)
+        size = nSamples * 4
+        dt1 = self.models["prepare"].predict(nSamples, SRat)
+        dt2 = self.models["record"].predict(nSamples, SRat)
+        stored = nSamples > STORE_LIMIT
+        dt3 = 0 if stored else self.models["export"].predict(nSamples, SRat)
+        clock, recording, landed, backlog = 0., 0., 0, 0
+        exported = keptFull = 0
+        for _ in range(files):
+            # the IQR is configured and waits for the next trigger
+            clock += self.overhead
+            if trigger:
+                clock = np.ceil(clock / trigger) * trigger
+            clock += dt1 + dt2
+            recording += dt2
+            if stored or (free is not None and landed + size > free):
+                if iqrCapacity is not None and backlog + size > iqrCapacity:
+                    keptFull += 1
+                    continue
+                backlog += size
+            else:
+                clock += dt3
+                landed += size
+                exported += 1
+        return {
+                "span": span,
+                "duration": duration,
+                "number of samples": nSamples,
+                "cycle": clock / files if files else 0,
+                "files per hour": files * 3600 / clock if clock else 0,
+                "dead time": 1 - recording / clock if clock else 0,
+                "recorded hours": recording / 3600,
+                "run hours": clock / 3600,
+                "disk usage": landed,
+                "exported": exported,
+                "IQR backlog": backlog,
+                "lost": keptFull,
+                }
+
+    def report(self):
+        lines = ["{:d} past files, cycle overhead {:.2f} s".format(len(self.files), self.overhead)]
+        for phase, model in self.models.items():
+            unit = "s per 1e6 samples" if phase != "record" else "s per s"
+            scale = 1e6 if phase != "record" else 1
+            lines.append("{:8s} {:.2f} s + {:.4f} {:s} (from {:d} files, rms {:s})".format(
+                phase, model.coef[0], model.coef[1] * scale, unit, model.count, "-" if model.rms is None else "{:.2f} s".format(model.rms)))
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="predict the duty cycle of a run plan from the past timings of the DAQ")
+    parser.add_argument("logs", nargs='+', help="daq.log files")
+    parser.add_argument("-j", "--journal", help="daq.journal file")
+    parser.add_argument("--headers", help="folder of the .wvh headers of the past files")
+    parser.add_argument("--span", type=float, nargs='+', default=[500], help="span(s) [kHz]")
+    parser.add_argument("--duration", type=float, nargs='+', default=[10], help="duration(s) of one file [s]")
+    parser.add_argument("--files", type=int, default=100, help="number of files in the run")
+    parser.add_argument("--trigger", type=float, help="interval between the triggers [s], manual mode if omitted")
+    parser.add_argument("--free", type=float, help="free space of the landing folder [GB]")
+    parser.add_argument("--iqr", type=float, help="capacity of the IQR storage [GB]")
+    args = parser.parse_args()
+
+    history = History(args.headers)
+    for fileName in args.logs:
+        history.readLog(fileName)
+    if args.journal:
+        history.readJournal(args.journal)
+    planner = Planner(history.complete())
+    print(planner.report())
+    print()
+    print("{:>9s} {:>9s} {:>12s} {:>8s} {:>8s} {:>6s} {:>10s} {:>10s}".format("span/kHz", "dur/s", "samples", "cycle/s", "files/h", "dead", "disk/GB", "IQR/GB"))
+    for span in args.span:
+        for duration in args.duration:
+            result = planner.simulate(span, duration, args.files, args.trigger,
+                    None if args.free is None else args.free*1e9, None if args.iqr is None else args.iqr*1e9)
+            print("{span:9g} {duration:9g} {number of samples:12d} {cycle:8.2f} {files per hour:8.1f} {dead time:6.1%} {disk:10.2f} {backlog:10.2f}{note:s}".format(
+                disk=result["disk usage"]/1e9, backlog=result["IQR backlog"]/1e9,
+                note="  ({:d} lost on a full IQR)".format(result["lost"]) if result["lost"] else "", **result))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a streaming quality monitor of the recorded IQ data, to flag bad captures early,
+e.g. saturated ADC data from a wrong reference level, missing signal, or all-zero files.
+A RAW data file (interleaved I/Q in little-endian int16) is read in chunks which are reduced by a worker pool
+into running sums, so that the whole file never has to be in memory. The same accumulator can be fed by a live stream.
+The statistics are the RMS power, the fraction of samples at ±32767, the DC offset and the IQ imbalance,
+and the alarms are raised by comparing them with the thresholds.
+To check files from the command line, run `python3 quality.py <file> [<file> ...]`.
+'''
+
+import os, math, logging, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class QualityStats():
+    '''
+    running sums of a stream of IQ samples
+    '''
+
+    def __init__(self):
+        self.n = 0 # number of IQ pairs
+        self.sumI = self.sumQ = 0.
+        self.sumII = self.sumQQ = self.sumIQ = 0.
+        self.clipped = 0 # number of I or Q at full scale
+        self.zeros = 0 # number of IQ pairs equal to zero
+
+    def update(self, data):
+        '''
+        data: int16 array of interleaved I/Q
+        '''
+        iq = data[:len(data)//2*2].reshape(-1, 2)
+        I = iq[:,0].astype(np.float64)
+        Q = iq[:,1].astype(np.float64)
+        self.n += len(iq)
+        self.sumI += I.sum()
+        self.sumQ += Q.sum()
+        self.sumII += np.dot(I, I)
+        self.sumQQ += np.dot(Q, Q)
+        self.sumIQ += np.dot(I, Q)
+        self.clipped += int(np.count_nonzero(np.abs(iq.astype(np.int32)) >= 32767))
+        self.zeros += int(np.count_nonzero((iq[:,0] == 0) & (iq[:,1] == 0)))
+        return self
+
+    def merge(self, other):
+        self.n += other.n
+        self.sumI += other.sumI
+        self.sumQ += other.sumQ
+        self.sumII += other.sumII
+        self.sumQQ += other.sumQQ
+        self.sumIQ += other.sumIQ
+        self.clipped += other.clipped
+        self.zeros += other.zeros
+        return self
+
+    def result(self, fullScale=32767):
+        '''
+        return the statistics normalized to the full scale
+        '''
+        if self.n == 0:
+            return {"samples": 0}
+        meanI, meanQ = self.sumI / self.n, self.sumQ / self.n
+        varI = max(self.sumII / self.n - meanI**2, 0)
+        varQ = max(self.sumQQ / self.n - meanQ**2, 0)
+        covIQ = self.sumIQ / self.n - meanI * meanQ
+        power = (self.sumII + self.sumQQ) / self.n / fullScale**2
+        return {
+                "samples": self.n,
+                "rms power": 10 * math.log10(power) if power > 0 else None, # dBFS
+                "clipped fraction": self.clipped / (2 * self.n),
+                "zero fraction": self.zeros / self.n,
+                "dc offset": [meanI / fullScale, meanQ / fullScale], # FS
+                "amplitude imbalance": 10 * math.log10(varI / varQ) if varI > 0 and varQ > 0 else None, # dB
+                "phase imbalance": math.degrees(math.asin(max(-1, min(1, covIQ / math.sqrt(varI * varQ))))) if varI > 0 and varQ > 0 else None, # deg
+                }
+
+
+def chunk_stats(fileName, offset, count):
+    '''
+    reduce `count` int16 values at the value `offset` of a file, run in the worker pool
+    '''
+    data = np.memmap(fileName, dtype="<i2", mode='r', offset=offset*2, shape=(count,))
+    return QualityStats().update(data)
+
+
+class QualityMonitor():
+    '''
+    compute the statistics of a RAW data file in chunks with a worker pool and raise the alarms
+    '''
+
+    def __init__(self, workers=4, chunkSize=2**23, clipLimit=1e-4, minPower=-80, maxOffset=.05, maxAmplitude=1, maxPhase=5):
+        '''
+        workers:        number of parallel workers (numpy releases the GIL in the reductions)
+        chunkSize:      number of int16 values in one chunk
+        clipLimit:      maximum fraction of values at full scale [1]
+        minPower:       minimum RMS power of a signal [dBFS]
+        maxOffset:      maximum DC offset of I or Q [FS]
+        maxAmplitude:   maximum IQ amplitude imbalance [dB]
+        maxPhase:       maximum IQ phase imbalance [deg]
+        '''
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self.clipLimit = clipLimit
+        self.minPower = minPower
+        self.maxOffset = maxOffset
+        self.maxAmplitude = maxAmplitude
+        self.maxPhase = maxPhase
+        self.logger = logging.getLogger("QUAL")
+
+    def analyze(self, fileName, stride=1):
+        '''
+        fileName:   path of the RAW data file
+        stride:     analyze every `stride`-th chunk only, to spare the bandwidth of a remote file
+        return the statistics with the alarms and a verdict of 'good', 'suspicious' or 'bad'
+        '''
+        total = os.path.getsize(fileName) // 2
+        chunks = [(offset, min(self.chunkSize, total - offset)) for offset in range(0, total, self.chunkSize * stride)]
+        stats = QualityStats()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for partial in pool.map(lambda chunk: chunk_stats(fileName, *chunk), chunks):
+                stats.merge(partial)
+        result = self.judge(stats.result())
+        result["stride"] = stride
+        for alarm in result["alarms"]:
+            self.logger.warning("'{:s}': {:s}".format(os.path.basename(fileName), alarm))
+        return result
+
+    def judge(self, result):
+        '''
+        add the alarms and the verdict to the statistics
+        '''
+        bad, suspicious = [], []
+        if result["samples"] == 0:
+            bad.append("empty file")
+        elif result["zero fraction"] == 1:
+            bad.append("all-zero data")
+        else:
+            if result["clipped fraction"] > self.clipLimit:
+                bad.append("saturated ADC, {:.2e} of the samples at full scale, check the reference level".format(result["clipped fraction"]))
+            if result["rms power"] is None or result["rms power"] < self.minPower:
+                bad.append("no signal, RMS power below {:g} dBFS".format(self.minPower))
+            if max(abs(offset) for offset in result["dc offset"]) > self.maxOffset:
+                suspicious.append("DC offset of ({:.3f}, {:.3f}) FS".format(*result["dc offset"]))
+            if result["amplitude imbalance"] is not None and abs(result["amplitude imbalance"]) > self.maxAmplitude:
+                suspicious.append("IQ amplitude imbalance of {:.2f} dB".format(result["amplitude imbalance"]))
+            if result["phase imbalance"] is not None and abs(result["phase imbalance"]) > self.maxPhase:
+                suspicious.append("IQ phase imbalance of {:.1f} deg".format(result["phase imbalance"]))
+        result["alarms"] = bad + suspicious
+        result["verdict"] = "bad" if bad else "suspicious" if suspicious else "good"
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="check the quality of RAW data files")
+    parser.add_argument("files", nargs='+', help="RAW data files of interleaved int16 I/Q")
+    parser.add_argument("-s", "--stride", type=int, default=1, help="analyze every n-th chunk only")
+    args = parser.parse_args()
+    logging.getLogger("QUAL").setLevel(logging.ERROR) # the alarms are printed below
+    monitor = QualityMonitor()
+    for fileName in args.files:
+        result = monitor.analyze(fileName, args.stride)
+        print("{:s}: {:s}".format(fileName, result["verdict"]))
+        if result["samples"]:
+            print("    RMS power: {}  clipped: {:.2e}  DC offset: ({:.4f}, {:.4f})".format(
+                "{:.1f} dBFS".format(result["rms power"]) if result["rms power"] is not None else "-", result["clipped fraction"], *result["dc offset"]))
+        for alarm in result["alarms"]:
+            print("    ! " + alarm)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides an optional reduction of the stored data by a digital down-conversion,
+for the studies whose peaks of interest only fill a narrow sub-band of the recorded span.
+A RAW data file (interleaved I/Q in little-endian int16) is shifted by `offset` to the center of the sub-band,
+low-pass filtered and decimated by `decimation` with a polyphase FIR filter.
+The file is cut into chunks which are processed in a process pool, each chunk being read with the history
+of the filter length before it (overlap-save) and mixed with the phase of its absolute sample index,
+so that the output does not depend on the chunk edges.
+A long-lived caller reducing file after file passes its own pool from `process_pool`, rather than spawning one per file.
+To reduce a file from the command line, run `python3 reduction.py <source> <destination> <SRat> <offset> <decimation>`.
+'''
+
+import os, logging, argparse, collections, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def design_lowpass(decimation, tapsPerPhase):
+    '''
+    return a Kaiser-windowed sinc low-pass filter of unit DC gain, cutting at the new Nyquist frequency
+    '''
+    length = decimation * tapsPerPhase
+    n = np.arange(length) - (length - 1) / 2
+    taps = np.sinc(n / decimation) * np.kaiser(length, 8.)
+    return taps / taps.sum()
+
+
+def ddc_chunk(source, total, start, count, shift, taps, decimation, gain):
+    '''
+    down-convert the `count` outputs from the output index `start`, run in the process pool
+    source:     path of the RAW data file
+    total:      number of IQ samples in the file
+    shift:      frequency shift normalized to the sampling rate [cycles/sample]
+    '''
+    K = len(taps) // decimation
+    # input samples from (start-K)*D+1 to (start+count-1)*D, the history before the file start is zero
+    first = (start - K) * decimation + 1
+    last = (start + count - 1) * decimation + 1
+    data = np.memmap(source, dtype="<i2", mode='r', shape=(total*2,))
+    x = np.zeros(last - first, dtype=np.complex128)
+    lo = max(first, 0)
+    iq = data[2*lo:2*last].astype(np.float64)
+    x[lo-first:] = iq[0::2] + 1j * iq[1::2]
+    # mix with the phase of the absolute sample index
+    phase = np.mod(shift * np.arange(first, last, dtype=np.float64), 1.)
+    x *= np.exp(-2j * np.pi * phase)
+    # polyphase decimation, y[m] = sum_p sum_j h[jD+p] x[(m-j)D-p]
+    y = np.zeros(count, dtype=np.complex128)
+    for p in range(decimation):
+        y += np.convolve(x[decimation-1-p::decimation], taps[p::decimation], mode='valid')
+    y *= gain
+    out = np.empty(2*count, dtype="<i2")
+    out[0::2] = np.clip(np.rint(y.real), -32768, 32767)
+    out[1::2] = np.clip(np.rint(y.imag), -32768, 32767)
+    return out.tobytes()
+
+
+def process_pool(workers=None):
+    '''
+    return a pool of processes for the chunks, to be shut down by the caller
+    workers:    number of processes, the number of CPUs by default
+    '''
+    # spawn the processes rather than fork them, the caller may be a multithreaded Qt application
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+
+class DownConverter():
+    '''
+    shift a sub-band to zero frequency, then filter and decimate it, chunk by chunk in a process pool
+    '''
+
+    def __init__(self, SRat, offset, decimation, tapsPerPhase=16, chunkSize=2**20, workers=None, gain=1):
+        '''
+        SRat:           sampling rate of the source [Hz]
+        offset:         center of the sub-band relative to the center frequency [Hz]
+        decimation:     decimation factor
+        tapsPerPhase:   number of filter taps per polyphase branch
+        chunkSize:      number of output samples in one chunk
+        workers:        number of processes, the number of CPUs by default
+        gain:           gain applied before the int16 quantization
+        '''
+        self.SRat = SRat
+        self.offset = offset
+        self.decimation = int(decimation)
+        if self.decimation < 1:
+            raise ValueError("decimation factor must be a positive integer")
+        if abs(offset) + SRat / self.decimation / 2 > SRat / 2:
+            raise ValueError("sub-band of {:g} Hz at {:g} Hz exceeds the recorded band".format(SRat / self.decimation, offset))
+        self.taps = design_lowpass(self.decimation, tapsPerPhase)
+        self.chunkSize = chunkSize
+        self.workers = workers or os.cpu_count()
+        self.gain = gain
+        self.logger = logging.getLogger("DDC")
+
+    def run(self, source, destination, progress=None, pool=None):
+        '''
+        source:         path of the RAW data file
+        destination:    path of the reduced file
+        progress:       callback function `progress(percentage)`
+        pool:           pool of processes from `process_pool`, a pool of `workers` is made for this file if None
+        return the number of IQ samples in the reduced file
+        '''
+        total = os.path.getsize(source) // 4
+        outputs = total // self.decimation
+        starts = list(range(0, outputs, self.chunkSize))
+        args = (self.offset / self.SRat, self.taps, self.decimation, self.gain)
+        owned = pool is None
+        if owned:
+            pool = process_pool(self.workers)
+        try:
+            with open(destination + ".part", 'wb') as out:
+                # keep a bounded number of chunks in flight, and write them in order
+                window = 2 * self.workers
+                futures = collections.deque()
+                written = 0
+                for start in starts:
+                    futures.append(pool.submit(ddc_chunk, source, total, start, min(self.chunkSize, outputs - start), *args))
+                    while len(futures) >= window or (start == starts[-1] and futures):
+                        out.write(futures.popleft().result())
+                        written += 1
+                        if progress is not None:
+                            progress(int(written * 100 / len(starts)))
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            if owned:
+                pool.shutdown()
+        os.replace(destination + ".part", destination)
+        self.logger.info("'{:s}' is reduced by {:d} into '{:s}'".format(source, self.decimation, destination))
+        return outputs
+
+    def header(self, metadata, parent):
+        '''
+        return the metadata of the reduced file
+        metadata:   metadata of the source file
+        parent:     name of the source file
+        '''
+        reduced = dict(metadata)
+        reduced["parent"] = parent
+        reduced["decimation"] = self.decimation
+        reduced["center frequency"] = metadata["center frequency"] + self.offset
+        reduced["sampling rate"] = metadata["sampling rate"] / self.decimation
+        reduced["span"] = reduced["sampling rate"] / 1.25
+        reduced["number of samples"] = metadata["number of samples"] // self.decimation
+        reduced["filter delay"] = (len(self.taps) - 1) / 2 / metadata["sampling rate"] # s
+        reduced.pop("quality", None)
+        return reduced
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="down-convert and decimate a RAW data file")
+    parser.add_argument("source", help="RAW data file of interleaved int16 I/Q")
+    parser.add_argument("destination", help="reduced data file")
+    parser.add_argument("SRat", type=float, help="sampling rate of the source [Hz]")
+    parser.add_argument("offset", type=float, help="center of the sub-band relative to the center frequency [Hz]")
+    parser.add_argument("decimation", type=int, help="decimation factor")
+    args = parser.parse_args()
+    converter = DownConverter(args.SRat, args.offset, args.decimation)
+    converter.run(args.source, args.destination, lambda percentVal: print("\r{:3d}%".format(percentVal), end='', flush=True))
+    print()
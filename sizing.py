@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides an adaptive sizing of the files, to maximize the fraction of the time spent recording.
+The preparing, recording and exporting times of the recent files are fitted against their number of samples
+(with the cost models of `planner.py`), together with the overhead between two files and the interval between
+the triggers. For the next file, every size within the limits set by the operator is then put on the timeline:
+    free running:   the next file starts as soon as the current one is exported
+    triggered:      the next file starts on the first trigger after the current one is exported
+and the size with the largest recording fraction is chosen.
+A file is exported now, unless the export would make the next file miss a trigger that it could catch otherwise,
+in which case it is kept in the IQR and its export is deferred to the end of the run, within a limited backlog.
+'''
+
+import time, collections
+
+import numpy as np
+
+from planner import PhaseModel, BLOCK, STORE_LIMIT
+
+
+class AdaptiveSizer():
+    '''
+    choose the number of samples of every file from the live throughput
+    '''
+
+    def __init__(self, minSamples, maxSamples, window=20, warmup=3, armDelay=2, maxDeferred=10):
+        '''
+        minSamples:     minimum number of samples of a file
+        maxSamples:     maximum number of samples of a file
+        window:         number of recent files the models are fitted on
+        warmup:         number of files observed before adapting
+        armDelay:       delay between the IQR ready and the trigger listening or the manual start [s]
+        maxDeferred:    maximum number of files with their export deferred
+        '''
+        self.minSamples = max(int(np.ceil(minSamples / BLOCK)), 1) * BLOCK
+        self.maxSamples = max(int(maxSamples // BLOCK) * BLOCK, self.minSamples)
+        self.warmup = warmup
+        self.armDelay = armDelay
+        self.maxDeferred = maxDeferred
+        self.files = collections.deque(maxlen=window)
+        self.gaps = collections.deque(maxlen=window)
+        self.triggers = collections.deque(maxlen=window+1)
+        self.models = {
+                "prepare": PhaseModel("dt1", lambda nSamples, SRat: nSamples, "constant"),
+                "record": PhaseModel("dt2", lambda nSamples, SRat: nSamples / SRat),
+                "export": PhaseModel("dt3", lambda nSamples, SRat: nSamples),
+                }
+
+    def clamp(self, nSamples):
+        return min(max(nSamples, self.minSamples), self.maxSamples)
+
+    def observe(self, nSamples, SRat, dt1, dt2, dt3=None):
+        '''
+        add the timings of a completed file, `dt3` is None for a file not exported
+        '''
+        self.files.append({"number of samples": nSamples, "sampling rate": SRat, "dt1": dt1, "dt2": dt2, "dt3": dt3})
+        self.models["prepare"].fit(self.files)
+        self.models["record"].fit(self.files)
+        self.models["export"].fit(self.files)
+
+    def gap(self, seconds):
+        '''
+        add the time from the end of a file to the IQR being ready for the next one [s]
+        '''
+        self.gaps.append(seconds)
+
+    def trigger(self, timestamp=None):
+        self.triggers.append(time.time() if timestamp is None else timestamp)
+
+    @property
+    def ready(self):
+        return self.models["record"].count >= self.warmup
+
+    @property
+    def interval(self):
+        '''
+        the median interval between the recent triggers [s], None without at least two of them
+        '''
+        if len(self.triggers) < 2:
+            return None
+        return float(np.median(np.diff(self.triggers)))
+
+    def exportTime(self, nSamples, SRat):
+        return 0 if nSamples > STORE_LIMIT else self.models["export"].predict(nSamples, SRat)
+
+    def cycle(self, nSamples, SRat, export=True):
+        '''
+        return the recording time of a file and the time until the next file starts [s]
+        '''
+        overhead = (float(np.median(self.gaps)) if self.gaps else 0) + self.armDelay
+        dt2 = self.models["record"].predict(nSamples, SRat)
+        busy = self.models["prepare"].predict(nSamples, SRat) + dt2 + overhead + (self.exportTime(nSamples, SRat) if export else 0)
+        interval = self.interval
+        if interval:
+            # the file starts on a trigger, the next one on the first trigger after it is ready
+            busy = max(np.ceil(busy / interval), 1) * interval
+        return dt2, busy
+
+    def exportNow(self, nSamples, SRat, backlog=0):
+        '''
+        decide whether to export a recorded file now, rather than after the run
+        backlog:    number of files already deferred
+        '''
+        if not self.ready or self.interval is None or backlog >= self.maxDeferred:
+            return True
+        # deferring only pays off when it lets the next file catch an earlier trigger
+        return self.cycle(nSamples, SRat, True)[1] <= self.cycle(nSamples, SRat, False)[1]
+
+    def choose(self, SRat, default, backlog=0):
+        '''
+        return the number of samples of the next file and its expected recording fraction (None while warming up)
+        default:    number of samples set by the operator
+        backlog:    number of files already deferred
+        '''
+        if not self.ready:
+            return self.clamp(default), None
+        # the files over the store limit are never exported, which would look free of export time,
+        # hence they are only candidates when the operator has chosen such a size
+        upper = self.maxSamples if default > STORE_LIMIT else min(self.maxSamples, max(int(STORE_LIMIT // BLOCK) * BLOCK, self.minSamples))
+        best, bestFraction = min(self.clamp(default), upper), -1
+        for nSamples in range(self.minSamples, upper + 1, BLOCK):
+            export = self.exportNow(nSamples, SRat, backlog)
+            dt2, busy = self.cycle(nSamples, SRat, export)
+            fraction = dt2 / busy if busy > 0 else 0
+            # a longer file is only taken for a clear gain, to keep the files short for the same duty cycle
+            if fraction > bestFraction + 1e-3:
+                best, bestFraction = nSamples, fraction
+        return best, bestFraction
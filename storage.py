@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a storage manager of the landing folder, where the data files are exported to.
+It estimates the bytes needed by the next file from its number of samples and compares them with the free space,
+so that the DAQ can keep the file in the IQR or pause arming instead of stalling on a full disk.
+In the background, it migrates the older verified files (i.e. with their `.wvh` header and the expected size)
+to a second storage tier, copying with a throttled bandwidth and a checksum, to keep the landing disk fast.
+'''
+
+import os, time, json, shutil, logging, threading, zlib
+
+
+class StorageManager():
+    '''
+    watch the free space of the landing folder and migrate the old files to a second tier
+    '''
+
+    def __init__(self, folder, tierFolder=None, reserve=20e9, floor=1e9, margin=1.05, migrateAge=24*3600, minAge=600, throttle=100e6, dataSuffix=".wvd"):
+        '''
+        folder:         the landing folder
+        tierFolder:     the folder of the second storage tier, None to disable the migration
+        reserve:        free space to be kept after the next file [byte]
+        floor:          free space under which no file may be armed at all [byte]
+        margin:         safety factor on the estimated file size
+        migrateAge:     age from which the files are migrated [s]
+        minAge:         age under which the files are never migrated, even when the headroom is low [s]
+        throttle:       maximum migration bandwidth [byte/s]
+        dataSuffix:     suffix of the RAW data files
+        '''
+        self.folder = folder
+        self.tierFolder = tierFolder
+        self.reserve = reserve
+        self.floor = floor
+        self.margin = margin
+        self.migrateAge = migrateAge
+        self.minAge = minAge
+        self.throttle = throttle
+        self.dataSuffix = dataSuffix
+        self.logger = logging.getLogger("STOR")
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def required(self, nSamples):
+        '''
+        estimated bytes of a file of `nSamples` IQ samples in int16, with its header
+        '''
+        return int(nSamples * 4 * self.margin) + 4096
+
+    def free(self):
+        return shutil.disk_usage(self.folder).free
+
+    def enough(self, nSamples):
+        '''
+        check if a file of `nSamples` can land while keeping the reserve
+        '''
+        return self.free() - self.required(nSamples) >= self.reserve
+
+    def critical(self):
+        '''
+        check if the free space is too low to arm any file
+        '''
+        return self.free() < self.floor
+
+    def candidates(self, minAge):
+        '''
+        return the verified data files older than `minAge`, oldest first, as (name, [paths])
+        '''
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith(".wvh") or entry.name.endswith(".bak.wvh"):
+                continue
+            name = entry.name[:-4]
+            data = os.path.join(self.folder, name + self.dataSuffix)
+            try:
+                stat = os.stat(data)
+            except FileNotFoundError:
+                continue
+            if now - max(stat.st_mtime, entry.stat().st_mtime) < minAge:
+                continue
+            try:
+                with open(entry.path, 'r') as header:
+                    nSamples = json.load(header)["number of samples"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if stat.st_size != nSamples * 4:
+                continue
+            files.append((stat.st_mtime, name, [data, entry.path]))
+        return [(name, paths) for _, name, paths in sorted(files)]
+
+    def copy(self, source, destination):
+        '''
+        copy a file with a throttled bandwidth, then verify the copy by its checksum
+        '''
+        blockSize = 4 * 2**20
+        crc = 0
+        t0 = time.time()
+        copied = 0
+        with open(source, 'rb') as src, open(destination + ".part", 'wb') as dst:
+            while not self.stopped.is_set():
+                block = src.read(blockSize)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                dst.write(block)
+                copied += len(block)
+                # sleep as long as needed to stay under the throttle
+                delay = copied / self.throttle - (time.time() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            dst.flush()
+            os.fsync(dst.fileno())
+        if self.stopped.is_set():
+            os.remove(destination + ".part")
+            return False
+        check = 0
+        with open(destination + ".part", 'rb') as dst:
+            for block in iter(lambda: dst.read(blockSize), b''):
+                check = zlib.crc32(block, check)
+        if check != crc:
+            os.remove(destination + ".part")
+            raise IOError("checksum of '{:s}' mismatches".format(destination))
+        os.replace(destination + ".part", destination)
+        return True
+
+    def migrate(self, name, paths):
+        '''
+        move the data file and its header to the second tier, the originals are removed once both are verified
+        '''
+        for path in paths:
+            if not self.copy(path, os.path.join(self.tierFolder, os.path.basename(path))):
+                return False
+        for path in paths:
+            os.remove(path)
+        self.logger.info("file '{:s}' is migrated to '{:s}'".format(name, self.tierFolder))
+        return True
+
+    def loop(self, interval):
+        while not self.stopped.wait(interval):
+            # the old files are always migrated, the younger ones too when the headroom is low
+            low = self.free() < 2 * self.reserve
+            for name, paths in self.candidates(self.minAge if low else self.migrateAge):
+                if self.stopped.is_set() or not (low or time.time() - os.stat(paths[0]).st_mtime >= self.migrateAge):
+                    break
+                try:
+                    if not self.migrate(name, paths):
+                        break
+                except OSError as error:
+                    self.logger.warning("file '{:s}' fails to be migrated: {}".format(name, error))
+                    break
+                low = self.free() < 2 * self.reserve
+
+    def start(self, interval=60):
+        '''
+        start the background migration, if a second tier is set
+        '''
+        if self.tierFolder is None or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.loop, args=(interval,), name="migration", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+tests of the control API, against the stand-in of the acquisition, run with `python3 -m pytest`
+'''
+
+import sys, json, time, threading, urllib.request, urllib.error
+
+import pytest
+
+from control import EventBus, ControlServer, StandIn
+
+
+@pytest.fixture
+def api():
+    '''
+    yield a function starting a server on a free port, with its bus and its url
+    '''
+    servers = []
+
+    def serve(token=None, handler=None, backlog=1000):
+        bus = EventBus(backlog)
+        server = ControlServer(bus, handler or StandIn(bus, step=.01).handler, port=0, token=token)
+        server.start()
+        servers.append(server)
+        return bus, server, "http://127.0.0.1:{:d}".format(server.httpd.server_address[1])
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+def post(url, command, token=None):
+    request = urllib.request.Request(url + "/command", json.dumps(command).encode("utf-8"), {"Content-Type": "application/json"})
+    if token is not None:
+        request.add_header("X-DAQ-Token", token)
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def events(response):
+    '''
+    yield the events of a server-sent stream
+    '''
+    for line in response:
+        if line.startswith(b"data: "):
+            yield json.loads(line[6:])
+
+
+@pytest.mark.parametrize("command", [
+    [],
+    {},
+    {"command": "reboot"},
+    {"command": "set"},
+    {"command": "set", "parameters": [500]},
+    {"command": "scan"},
+    {"command": "scan", "plan": []},
+    {"command": "scan", "plan": [{"span": 500}]},
+    {"command": "scan", "plan": [{"span": 500, "files": 0}]},
+    {"command": "scan", "plan": [{"span": 500, "files": "10"}]},
+])
+def test_validate_rejects(api, command):
+    bus, server, url = api()
+    assert server.validate(command) is not None
+    assert post(url, command)[0] == 400
+
+
+@pytest.mark.parametrize("command", [
+    {"command": "start"},
+    {"command": "stop"},
+    {"command": "set", "parameters": {"span": 500}},
+    {"command": "scan", "plan": [{"span": 500, "files": 10}]},
+])
+def test_validate_accepts(api, command):
+    bus, server, url = api(handler=lambda command: None)
+    assert server.validate(command) is None
+    assert post(url, command) == (202, {"accepted": command["command"]})
+
+
+def test_token(api):
+    received = []
+    bus, server, url = api(token="secret", handler=received.append)
+    assert post(url, {"command": "stop"})[0] == 403
+    assert post(url, {"command": "stop"}, "wrong")[0] == 403
+    assert received == []
+    assert post(url, {"command": "stop"}, "secret")[0] == 202
+    assert received == [{"command": "stop"}]
+
+
+def test_status(api):
+    bus, server, url = api()
+    bus.publish("phase", phase="recorded", name="a", number=1)
+    bus.publish("phase", phase="exported", name="a", number=1)
+    bus.publish("alarm", alarms=["clipping"])
+    with urllib.request.urlopen(url + "/status", timeout=5) as response:
+        status = json.load(response)
+    # the latest event of each kind
+    assert status["phase"]["phase"] == "exported"
+    assert status["alarm"]["alarms"] == ["clipping"]
+    # the snapshot is a copy, not the live state
+    snapshot = bus.snapshot()
+    snapshot["phase"]["phase"] = "changed"
+    assert bus.snapshot()["phase"]["phase"] == "exported"
+
+
+def test_events(api):
+    bus, server, url = api()
+    with urllib.request.urlopen(url + "/events", timeout=5) as response:
+        deadline = time.time() + 5
+        while not bus.subscribers and time.time() < deadline:
+            time.sleep(.01)
+        assert post(url, {"command": "start"})[0] == 202
+        phases = []
+        for event in events(response):
+            if event["kind"] == "phase":
+                phases.append(event["phase"])
+                if event["phase"] == "header":
+                    break
+        post(url, {"command": "stop"})
+    assert phases == ["prepared", "recorded", "exporting", "exported", "header"]
+
+
+def test_slow_subscriber():
+    bus = EventBus(backlog=3)
+    subscriber = bus.subscribe()
+    for value in range(5):
+        bus.publish("progress", value=value)
+    # the oldest events are dropped, the latest ones are kept in order
+    assert [subscriber.get_nowait()["value"] for _ in range(3)] == [2, 3, 4]
+    assert subscriber.empty()
+    bus.unsubscribe(subscriber)
+    bus.publish("progress", value=5)
+    assert subscriber.empty()
+
+
+def test_concurrent_publishers():
+    bus = EventBus(backlog=2)
+    subscriber = bus.subscribe()
+    errors = []
+    # switch the threads as often as possible, for the publishers to interleave on the full queue
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def publish(thread):
+        try:
+            for value in range(5000):
+                bus.publish("progress", thread=thread, value=value)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=publish, args=(thread,)) for thread in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    # a full queue never makes a publisher fail
+    assert errors == []
+    assert subscriber.qsize() == 2
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+tests of the write-ahead journal, against a temporary folder, run with `python3 -m pytest`
+'''
+
+import json
+
+import pytest
+
+from journal import Journal
+
+
+PARAMETERS = {"center frequency": 243.5e6, "span": 500e3, "reference level": -30, "duration": 10}
+
+
+@pytest.fixture
+def fileName(tmp_path):
+    return str(tmp_path / "daq.journal")
+
+
+def record(journal, name, number, order, *phases, **timings):
+    journal.append("prepared", name=name, number=number, order=order, metadata={"number of samples": 2621440})
+    for phase in phases:
+        journal.append(phase, name=name, **(timings if phase == "recorded" else {}))
+
+
+def test_replay(fileName):
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    record(journal, "a", 1, 1, "triggered", "recorded", "exporting", "exported", "header", dt1=1, dt2=10)
+    record(journal, "b", 2, 2, "triggered", "recorded", "exporting", dt1=1, dt2=10)
+    record(journal, "c", 3, 3, "triggered")
+    record(journal, "d", 4, 4)
+    # a crash in the middle of writing a record
+    with open(fileName, 'a') as torn:
+        torn.write('{"event": "recorded", "name": "d"')
+
+    resumed = Journal(fileName)
+    assert resumed.state["file number"] == 3
+    assert [entry["name"] for entry in resumed.pending("exporting")] == ["b"]
+    assert [entry["name"] for entry in resumed.pending("triggered", "recorded", "exporting")] == ["b", "c"]
+    assert [entry["name"] for entry in resumed.pending("prepared")] == ["d"]
+    assert resumed.pending("exporting")[0]["dt2"] == 10
+
+
+def test_compaction(fileName):
+    journal = Journal(fileName, compactEvery=10)
+    journal.append("run start", parameters=PARAMETERS)
+    for number in range(1, 21):
+        record(journal, "f{:d}".format(number), number, number, "triggered", "recorded", "exporting", "exported", "header", dt1=1, dt2=10)
+    record(journal, "last", 21, 21, "triggered", "recorded", dt1=1, dt2=10)
+    state = json.loads(json.dumps(journal.state))
+
+    journal = Journal(fileName)
+    with open(fileName, 'r') as compacted:
+        lines = compacted.readlines()
+    # a single checkpoint, with the unfinished file only
+    assert len(lines) == 1
+    assert json.loads(lines[0])["event"] == "checkpoint"
+    assert list(journal.state["files"]) == ["last"]
+    assert journal.state == state
+    assert journal.state["run"]["totals"] == [20, 200, 0]
+
+
+def test_resume_parameters(fileName):
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    record(journal, "a", 1, 1, "triggered", "recorded", "exporting", "exported", "header", dt1=1, dt2=10)
+
+    journal = Journal(fileName)
+    journal.append("run start", parameters=dict(PARAMETERS))
+    assert journal.state["run"]["order"] == 2
+    assert journal.state["run"]["totals"] == [1, 10, 0]
+    # other parameters start a new run
+    journal.append("run start", parameters=dict(PARAMETERS, span=100e3))
+    assert journal.state["run"]["order"] == 1
+    assert journal.state["run"]["totals"] == [0, 0, 0]
+    # a stopped run is not resumed
+    journal.append("run stop")
+    journal.append("run start", parameters=dict(PARAMETERS, span=100e3))
+    assert journal.state["run"]["order"] == 1
+
+
+def test_resume_order(fileName):
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    record(journal, "a", 1, 1, "triggered", "recorded", "exporting", "exported", "header", dt1=1, dt2=10)
+    record(journal, "b", 2, 2, "triggered", "recorded", "deferred", dt1=1, dt2=10)
+    record(journal, "c", 3, 3, "triggered", "recorded", "exporting", dt1=1, dt2=10)
+
+    # the unfinished files keep their order, the resumed run goes on after them
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    assert journal.state["run"]["order"] == 4
+    record(journal, "d", 4, 4, "triggered")
+    # the late headers of the leftover files add their timings, without moving the order back
+    journal.append("exported", name="c", dt3=2)
+    journal.append("header", name="c")
+    assert journal.state["run"]["order"] == 5
+    assert journal.state["run"]["totals"] == [2, 20, 2]
+
+
+def test_discarded_order(fileName):
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    record(journal, "a", 1, 1, "triggered", "discarded")
+    # the order of a failed file is given to the next one
+    assert journal.state["run"]["order"] == 1
+    record(journal, "b", 2, 1, "triggered")
+    assert journal.state["run"]["order"] == 2
+
+
+def test_leftovers_of_another_run(fileName):
+    journal = Journal(fileName)
+    journal.append("run start", parameters=PARAMETERS)
+    record(journal, "a", 1, 5, "triggered")
+
+    # the leftover file of the previous run neither moves the order nor the totals of a new run
+    journal = Journal(fileName)
+    journal.append("run start", parameters=dict(PARAMETERS, span=100e3))
+    journal.append("recorded", name="a", dt1=1, dt2=10)
+    journal.append("exported", name="a", dt3=2)
+    journal.append("header", name="a")
+    assert journal.state["run"]["order"] == 1
+    assert journal.state["run"]["totals"] == [0, 0, 0]
+    assert journal.state["file number"] == 1
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+tests of the transfer engine, against a temporary folder, run with `python3 -m pytest`
+'''
+
+import os
+
+import pytest
+
+import transfer
+from transfer import ParallelPull
+
+
+CHUNK = 64 * 2**10
+BLOCK = 4 * 2**10
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "source.wvd"
+    # not a whole number of chunks, so that the last one is short
+    path.write_bytes(os.urandom(40 * CHUNK + 1234))
+    return path
+
+
+def cancel_after(monkeypatch, pull, limit):
+    '''
+    cancel the pull once `limit` bytes have been read from the source
+    '''
+    pread = os.pread
+    count = [0]
+
+    def read(fd, size, offset):
+        data = pread(fd, size, offset)
+        count[0] += len(data)
+        if count[0] >= limit:
+            pull.cancel()
+        return data
+
+    monkeypatch.setattr(transfer.os, "pread", read)
+
+
+def test_pull(source, tmp_path):
+    destination = tmp_path / "pulled.wvd"
+    reports = []
+    ParallelPull(str(source), str(destination), 4, CHUNK, BLOCK, lambda done, total, rate: reports.append((done, total))).run()
+    assert destination.read_bytes() == source.read_bytes()
+    assert not os.path.exists(str(destination) + ".part")
+    assert not os.path.exists(str(destination) + ".part.json")
+    assert reports[-1] == (source.stat().st_size, source.stat().st_size)
+
+
+def test_cancel_resume(source, tmp_path, monkeypatch):
+    destination = tmp_path / "pulled.wvd"
+    size = source.stat().st_size
+    pull = ParallelPull(str(source), str(destination), 4, CHUNK, BLOCK)
+    cancel_after(monkeypatch, pull, size // 2)
+    with pytest.raises(RuntimeError):
+        pull.run()
+    monkeypatch.undo()
+    assert not destination.exists()
+    # the chunks completed before the cancel are checkpointed
+    done = pull.loadState(source.stat())
+    assert 0 < len(done) < 41
+
+    resumed = ParallelPull(str(source), str(destination), 4, CHUNK, BLOCK)
+    resumed.run()
+    assert destination.read_bytes() == source.read_bytes()
+    # only the missing chunks are pulled again
+    assert resumed.pulledBytes == size - sum(min(CHUNK, size - i * CHUNK) for i in done)
+    assert not os.path.exists(str(destination) + ".part.json")
+
+
+def test_resume_changed_source(source, tmp_path, monkeypatch):
+    destination = tmp_path / "pulled.wvd"
+    pull = ParallelPull(str(source), str(destination), 4, CHUNK, BLOCK)
+    cancel_after(monkeypatch, pull, source.stat().st_size // 2)
+    with pytest.raises(RuntimeError):
+        pull.run()
+    monkeypatch.undo()
+    # a new file under the same name is pulled from the start
+    source.write_bytes(os.urandom(20 * CHUNK))
+    resumed = ParallelPull(str(source), str(destination), 4, CHUNK, BLOCK)
+    resumed.run()
+    assert resumed.pulledBytes == 20 * CHUNK
+    assert destination.read_bytes() == source.read_bytes()
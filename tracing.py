@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides an opt-in tracing mode, to see where the time goes across the threads of the DAQ.
+The spans are recorded with the native thread IDs and nanosecond timestamps, and exported as Chrome trace-event json,
+to be opened in `chrome://tracing` or https://ui.perfetto.dev
+    span:       a synchronous piece of work on one thread, e.g. a `Worker` run or a SCPI write/read
+    transition: the phases of a file, which begin and end in different callbacks, as asynchronous spans
+    sample:     the stacks of all the threads taken by the optional sampling profiler
+To enable it, set the environment variable `DAQ_TRACE` to the output json file before launching `daq.py`,
+and `DAQ_TRACE_SAMPLE` to the sampling interval [ms] for the sampling profiler, only the main process is traced.
+When disabled, the tracing costs one attribute check per call.
+'''
+
+import os, sys, json, time, atexit, logging, threading, multiprocessing
+
+
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Span():
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter_ns()
+        self.tracer.record({"ph": "X", "name": self.name, "cat": self.cat, "ts": self.tracer.us(self.t0), "dur": (t1 - self.t0) / 1e3, "args": self.args})
+        return False
+
+
+class Tracer():
+    '''
+    collect the trace events in memory and export them on exit
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.threads = {}
+        self.phases = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("TRCE")
+
+    def enable(self, fileName, sampleInterval=None, maxEvents=2000000):
+        '''
+        fileName:       path of the exported json file
+        sampleInterval: interval of the sampling profiler [s], None to disable
+        maxEvents:      maximum number of events kept in memory
+        '''
+        self.fileName = fileName
+        self.maxEvents = maxEvents
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.enabled = True
+        atexit.register(self.export)
+        if sampleInterval:
+            threading.Thread(target=self.sample, args=(sampleInterval,), name="sampler", daemon=True).start()
+        self.logger.info("tracing to '{:s}'".format(fileName))
+
+    def us(self, ns):
+        return (ns - self.origin) / 1e3
+
+    def record(self, event, tid=None):
+        '''
+        tid: native ID of the thread the event belongs to, the calling thread by default
+        '''
+        own = tid is None
+        if own:
+            tid = threading.get_native_id()
+        event["pid"] = self.pid
+        event["tid"] = tid
+        with self.lock:
+            if own and tid not in self.threads:
+                self.threads[tid] = threading.current_thread().name
+            if len(self.events) < self.maxEvents:
+                self.events.append(event)
+
+    def span(self, name, cat="daq", **args):
+        '''
+        a context manager recording a complete event
+        '''
+        if not self.enabled:
+            return NullSpan()
+        return Span(self, name, cat, args)
+
+    def instant(self, name, cat="daq", **args):
+        if self.enabled:
+            self.record({"ph": "i", "s": "t", "name": name, "cat": cat, "ts": self.us(time.perf_counter_ns()), "args": args})
+
+    def transition(self, key, phase, terminal=("header", "discarded")):
+        '''
+        end the current phase of `key` (e.g. a file name) and begin the next one, as asynchronous spans
+        '''
+        if not self.enabled:
+            return
+        ts = self.us(time.perf_counter_ns())
+        with self.lock:
+            previous = self.phases.pop(key, None)
+            if phase not in terminal:
+                self.phases[key] = phase
+        if previous is not None:
+            self.record({"ph": "e", "name": previous, "cat": "phase", "id": key, "ts": ts})
+        if phase not in terminal:
+            self.record({"ph": "b", "name": phase, "cat": "phase", "id": key, "ts": ts, "args": {"file": key}})
+
+    def sample(self, interval):
+        '''
+        the sampling profiler, recording the stack of every other thread as an instant event
+        '''
+        own = threading.get_ident()
+        while self.enabled:
+            time.sleep(interval)
+            ts = self.us(time.perf_counter_ns())
+            natives = {thread.ident: thread.native_id for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 16:
+                    stack.append("{:s} ({:s}:{:d})".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename), frame.f_lineno))
+                    frame = frame.f_back
+                self.record({"ph": "i", "s": "t", "name": stack[0].split(' ')[0] if stack else "?", "cat": "sample", "ts": ts, "args": {"stack": stack}}, natives.get(ident, ident))
+
+    def export(self, fileName=None):
+        '''
+        write the collected events in the Chrome trace-event format
+        '''
+        if not self.enabled:
+            return
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        metadata.append({"ph": "M", "name": "process_name", "pid": self.pid, "args": {"name": "daq"}})
+        with open(fileName or self.fileName, 'w') as trace:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ns"}, trace)
+        self.logger.info("{:d} trace events exported".format(len(events)))
+
+
+tracer = Tracer()
+
+# the spawned processes of the reduction import this module again, and would overwrite the trace on their exit,
+# their parent is only known once their main module is imported, while their name is set before
+if os.environ.get("DAQ_TRACE") and multiprocessing.parent_process() is None and multiprocessing.current_process().name == "MainProcess":
+    tracer.enable(os.environ["DAQ_TRACE"], float(os.environ.get("DAQ_TRACE_SAMPLE", 0)) / 1e3 or None)
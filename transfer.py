@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+'''
+This script provides a transfer engine run by the server, to pull a RAW data file from the IQR
+instead of waiting for the IQR to push it through `SYSTem:ARCHive`.
+The storage `e:/` of the IQR is expected to be shared and mounted on the server (e.g. `/mnt/iqr/`),
+so that any directory, such as a local folder standing in for the file server, can be the source.
+The file is split into chunks which are pulled by several parallel range streams into a preallocated file.
+The completed chunks are checkpointed next to the destination, so that an interrupted pull is resumed.
+To test, run `python3 transfer.py <source> <destination>` against a local folder.
+'''
+
+import os, time, json, logging, threading, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelPull():
+    '''
+    pull one file by parallel range streams, with resumable chunks and live throughput reporting
+    '''
+
+    def __init__(self, source, destination, streams=4, chunkSize=32*2**20, blockSize=4*2**20, progress=None):
+        '''
+        source:         path of the file to be pulled, e.g. on the mounted share of the IQR
+        destination:    path of the pulled file on the server
+        streams:        number of parallel range streams
+        chunkSize:      size of a resumable chunk [byte]
+        blockSize:      size of a single read within a chunk [byte]
+        progress:       callback function `progress(doneBytes, totalBytes, rate)` with rate in [MB/s]
+        '''
+        self.source = source
+        self.destination = destination
+        self.streams = streams
+        self.chunkSize = chunkSize
+        self.blockSize = blockSize
+        self.progress = progress
+        self.partName = destination + ".part"
+        self.stateName = destination + ".part.json"
+        self.logger = logging.getLogger("PULL")
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def loadState(self, stat):
+        '''
+        return the indices of the chunks completed by a previous pull of the same source
+        '''
+        try:
+            with open(self.stateName, 'r') as record:
+                state = json.load(record)
+        except (OSError, ValueError):
+            return set()
+        if (state.get("size"), state.get("mtime"), state.get("chunk size")) != (stat.st_size, stat.st_mtime, self.chunkSize) or not os.path.exists(self.partName):
+            return set()
+        return set(state["done"])
+
+    def saveState(self, stat, done):
+        with open(self.stateName + ".tmp", 'w') as record:
+            json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "chunk size": self.chunkSize, "done": sorted(done)}, record)
+        os.replace(self.stateName + ".tmp", self.stateName)
+
+    def run(self):
+        '''
+        pull the file, return the average throughput [MB/s] of this pull
+        '''
+        stat = os.stat(self.source)
+        size = stat.st_size
+        nChunks = (size + self.chunkSize - 1) // self.chunkSize
+        done = self.loadState(stat)
+        if done:
+            self.logger.info("resume pulling '{:s}' with {:d}/{:d} chunks done".format(self.source, len(done), nChunks))
+        else:
+            # preallocate the destination to avoid fragmentation and late disk-full errors
+            with open(self.partName, 'wb') as part:
+                try:
+                    os.posix_fallocate(part.fileno(), 0, size)
+                except (AttributeError, OSError):
+                    part.truncate(size)
+            self.saveState(stat, done)
+        self.doneBytes = sum(min(self.chunkSize, size - i * self.chunkSize) for i in done)
+        self.pulledBytes = 0
+        synced = set(done) # chunks safely on the disk
+        pending = [i for i in range(nChunks) if i not in done]
+
+        src = os.open(self.source, os.O_RDONLY)
+        dst = os.open(self.partName, os.O_WRONLY)
+        t0 = tReport = tSync = time.time()
+        try:
+            def pull_chunk(index):
+                offset = index * self.chunkSize
+                end = min(offset + self.chunkSize, size)
+                while offset < end and not self.cancelled.is_set():
+                    data = os.pread(src, min(self.blockSize, end - offset), offset)
+                    if not data:
+                        raise IOError("'{:s}' is truncated at byte {:d}".format(self.source, offset))
+                    os.pwrite(dst, data, offset)
+                    offset += len(data)
+                    with self.lock:
+                        self.doneBytes += len(data)
+                        self.pulledBytes += len(data)
+                return index if offset >= end else None
+
+            with ThreadPoolExecutor(max_workers=self.streams) as pool:
+                futures = [pool.submit(pull_chunk, index) for index in pending]
+                completed = set()
+                while futures:
+                    time.sleep(.1)
+                    for future in [future for future in futures if future.done()]:
+                        futures.remove(future)
+                        try:
+                            index = future.result()
+                        except Exception:
+                            # stop the other streams, the chunks done so far are kept for resuming
+                            self.cancelled.set()
+                            raise
+                        if index is not None:
+                            completed.add(index)
+                    now = time.time()
+                    if now - tSync > 1 or not futures:
+                        # checkpoint only the chunks flushed to the disk
+                        os.fsync(dst)
+                        synced |= completed
+                        completed = set()
+                        self.saveState(stat, synced)
+                        tSync = now
+                    if self.progress is not None and (now - tReport > .5 or not futures):
+                        self.progress(self.doneBytes, size, self.pulledBytes / 1e6 / max(now - t0, 1e-6))
+                        tReport = now
+        finally:
+            os.close(src)
+            os.close(dst)
+
+        if self.cancelled.is_set():
+            raise RuntimeError("pull of '{:s}' is cancelled".format(self.source))
+        os.replace(self.partName, self.destination)
+        os.remove(self.stateName)
+        rate = self.pulledBytes / 1e6 / max(time.time() - t0, 1e-6)
+        self.logger.info("'{:s}' is pulled at {:.1f} MB/s".format(self.source, rate))
+        return rate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="pull a file by parallel range streams")
+    parser.add_argument("source", help="path of the file to be pulled")
+    parser.add_argument("destination", help="path of the pulled file")
+    parser.add_argument("-n", "--streams", type=int, default=4, help="number of parallel streams")
+    parser.add_argument("-c", "--chunk", type=int, default=32, help="chunk size [MiB]")
+    args = parser.parse_args()
+    report = lambda done, total, rate: print("\r{:6.2f}%  {:8.1f} MB/s".format(done*100/max(total, 1), rate), end='', flush=True)
+    ParallelPull(args.source, args.destination, args.streams, args.chunk*2**20, progress=report).run()
+    print()